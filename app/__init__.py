@@ -7,5 +7,14 @@ Unified CLI + API pipeline for TXT and CSV question answering.
 
 __version__ = "1.0.0"
 
-# Optional: re-export common functions for easier import
-from .core import process_inputs
+# Optional: re-export common functions for easier import. Resolved on
+# first use so that importing a light submodule (e.g. app.charts in the
+# chart render workers) does not load pandas and the OpenAI SDK.
+__all__ = ["process_inputs", "process_inputs_async"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import core
+        return getattr(core, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
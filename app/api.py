@@ -169,120 +169,284 @@ async def answer_questions(
 
     return JSONResponse(content=parsed)
 '''
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
-from openai import OpenAI
-import re, json, io
+import asyncio
+import hashlib
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import json
 import pandas as pd
+from app.llm import aclose_llm_clients, get_llm
+from app.io import CSV_OPTIMIZE, DATASET_PROJECTION, read_dataset, read_sample, summarize_csv_chunks
+from app.profile import DatasetProfile
+from app.dataset_cache import fingerprint, get_dataset_cache
+from app.charts import shutdown_chart_pool
+from app.web import extract_urls, scrape_many, aclose_web_client
+from app.retrieval import build_context, get_index
+from app.qna import column_index, confident_plan, extract_questions, instruction_text, plan_projection
+from app.csv_ops import execute_plans, phrase_result
+from app.schema import schema_profile
+from app.cache import bypass_cache
+from app import metrics
+from app.metrics import span
+
+# Model for the one-shot answer prompt; the client itself is shared and lazy
+API_MODEL = "gpt-4.1-mini"
+# Answer questions that map to an exact plan with pandas, without the LLM (?local=false opts out)
+API_LOCAL_ANSWERS = os.getenv("API_LOCAL_ANSWERS", "1") not in ("0", "false", "no")
 
-client = OpenAI()
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-# --- helper: extract first URL from text ---
-def extract_url(text: str) -> str | None:
-    match = re.search(r'(https?://\S+)', text)
-    return match.group(1) if match else None
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await aclose_llm_clients()
+    await aclose_web_client()
+    shutdown_chart_pool()
 
-@app.post("/")
-async def answer_questions(
-    questions_txt: UploadFile = File(...),
-    data: UploadFile = File(None)  # optional CSV
-):
-    # Read uploaded questions
-    content_bytes = await questions_txt.read()
-    questions = content_bytes.decode("utf-8").strip()
 
-    # Detect URL in the question file (optional)
-    url = None
-    if questions.lower().startswith("url:"):
-        first_line, *rest = questions.splitlines()
-        url = first_line.split(":", 1)[1].strip()
-        questions = "\n".join(rest)
-    else:
-        url = extract_url(questions)
+app = FastAPI(lifespan=lifespan)
 
-    # --- If CSV provided, summarize it ---
-    dataset_summary = ""
-    if data:
-        file_bytes = await data.read()
-        df = pd.read_csv(io.StringIO(file_bytes.decode("utf-8")))
-
-        # Summarize dataset (columns, dtypes, sample, stats)
-        dataset_summary = f"""
-        Columns: {list(df.columns)}
-        Data types: {df.dtypes.to_dict()}
-        Head:
-        {df.head(5).to_string(index=False)}
-        Summary stats:
-        {df.describe(include="all").to_string()}
-        """
 
-    # --- Build prompt for LLM ---
-    prompt = f"""
-    You are a data analyst. 
-    Context: Here is the dataset summary and metadata.
-    Dataset summary:
-    {dataset_summary}
+def _flag(request: Request, name: str) -> bool:
+    return request.query_params.get(name, "").lower() in ("1", "true", "yes")
 
-    Questions:
-    {questions}
 
-    Instructions:
-    - Answer the questions ONLY using the dataset summary above.
-    - Return your answers in the SAME order as the questions.
-    - Format the final output strictly as a valid JSON array: [a1, a2, a3, ...]
-    - Do not include explanations, keys, or text outside the array.
+class _SendThen:
+    """ASGI wrapper that runs `done` after `response` is sent, however sending ends."""
+
+    def __init__(self, response, done):
+        self.response = response
+        self.done = done
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.done()
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """
+    Trace every request: stage timings, peak RSS and request counters (see
+    app.metrics). The request is recorded once its response has been sent,
+    or failed to be (client gone, error while streaming). ?timing=true, or
+    METRICS_SERVER_TIMING=1, adds a Server-Timing header; streamed bodies
+    are timed to their end in the metrics, but the header can only cover
+    the time before streaming began. With METRICS_PROFILING=1,
+    ?profile=true samples the request and names the saved profile in an
+    X-Profile header.
     """
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    trace = metrics.start_request()
+    profiler = metrics.SamplingProfiler().start() if metrics.METRICS_PROFILING and _flag(request, "profile") else None
+    profile_path = profiler.default_path() if profiler is not None else None
+
+    def finish(status: int) -> None:
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.finish_request(trace, request.method, route, status)
+        if profiler is not None:
+            profiler.stop().save(profile_path)
 
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
-from openai import OpenAI
-import re, json, io
-import pandas as pd
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish(500)
+        raise
 
-client = OpenAI()
-app = FastAPI()
+    if metrics.METRICS_SERVER_TIMING or _flag(request, "timing"):
+        response.headers["Server-Timing"] = trace.server_timing()
+    if profile_path is not None:
+        response.headers["X-Profile"] = profile_path
 
-# --- helper: extract first URL from text ---
-def extract_url(text: str) -> str | None:
-    match = re.search(r'(https?://\S+)', text)
-    return match.group(1) if match else None
+    return _SendThen(response, lambda: finish(response.status_code))
 
 
-@app.post("/")
-async def answer_questions(
-    questions_txt: UploadFile = File(...),
-    data: UploadFile = File(None)  # optional CSV
-):
+@app.get("/metrics")
+def prometheus_metrics():
+    """Stage latencies, LLM tokens/retries and memory in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- helper: parse + profile an upload, reusing earlier results for identical files ---
+def load_upload(fileobj, chunked: bool = False, questions: Optional[List[str]] = None) -> dict:
+    """
+    Parsed frame and profile of an uploaded dataset (CSV, gzip/zstd CSV,
+    Parquet, Feather or Arrow). With `questions`, only the columns their
+    plans touch are parsed, unless a full parse is already cached.
+    """
+    cache = get_dataset_cache()
+    mode = "chunked" if chunked else ("optimized" if CSV_OPTIMIZE else "full")
+    digest = fingerprint(fileobj) if cache else None
+    key = f"{digest}-{mode}-v4" if cache else None
+    entry = cache.get(key) if cache else None
+    if entry is not None:
+        entry["profile"].attach(entry["df"])
+        return entry
+
+    columns = None
+    if questions and not chunked and DATASET_PROJECTION:
+        with span("dataset.plan"):
+            columns = plan_projection(questions, read_sample(fileobj))
+        if columns is not None and cache:
+            projection = hashlib.sha256(json.dumps([str(c) for c in columns]).encode()).hexdigest()[:16]
+            key = f"{digest}-{mode}-{projection}-v4"
+            entry = cache.get(key)
+            if entry is not None:
+                entry["profile"].attach(entry["df"])
+                return entry
+
+    if chunked:
+        summary = summarize_csv_chunks(fileobj)
+        entry = {"df": None, "profile": DatasetProfile.from_chunk_summary(summary)}
+    else:
+        # Parse straight from the spooled upload; no bytes/str copies
+        df = read_dataset(fileobj, columns, CSV_OPTIMIZE)
+        with span("dataset.profile"):
+            entry = {"df": df, "profile": DatasetProfile(df)}
+    if cache:
+        cache.put(key, entry)
+    return entry
+
+
+async def _read_inputs(questions_txt: UploadFile, data: Optional[UploadFile], chunked: bool) -> dict:
+    """
+    Questions, URLs, scraped page indexes and dataset profile of one
+    request. Everything touching the uploads happens here, before a
+    streamed response starts.
+    """
     # Read uploaded questions
-    content_bytes = await questions_txt.read()
+    with span("upload.read"):
+        content_bytes = await questions_txt.read()
     questions = content_bytes.decode("utf-8").strip()
 
-    # Detect URL in the question file (optional)
-    url = None
+    # Detect URLs in the question file (optional)
+    urls = []
     if questions.lower().startswith("url:"):
         first_line, *rest = questions.splitlines()
-        url = first_line.split(":", 1)[1].strip()
+        urls.append(first_line.split(":", 1)[1].strip())
         questions = "\n".join(rest)
-    else:
-        url = extract_url(questions)
-
-    # --- If CSV provided, summarize it ---
-    dataset_summary = ""
+    urls += [u for u in extract_urls(questions) if u not in urls]
+
+    # Scrape every URL concurrently (pooled + cached, never blocks the loop)
+    pages = []
+    if urls:
+        texts = await scrape_many(urls)
+        with span("retrieval.index"):
+            pages = [get_index(u, t) for u, t in zip(urls, texts)]
+
+    # Profile is cached by content hash (and column projection)
+    question_list = extract_questions(questions) or [questions]
+    instructions = instruction_text(questions)
+    profile, df = None, None
     if data:
-        file_bytes = await data.read()
-        df = pd.read_csv(io.StringIO(file_bytes.decode("utf-8")))
-
-        # Summarize dataset (columns, dtypes, sample, stats)
-        dataset_summary = f"""
-        Columns: {list(df.columns)}
-        Data types: {df.dtypes.to_dict()}
-        Head:
-        {df.head(5).to_string(index=False)}
-        Summary stats:
-        {df.describe(include="all").to_string()}
-        """
+        # Other instructions in the file go to the LLM too (and so keep every column)
+        with span("dataset.load"):
+            dataset = await run_in_threadpool(load_upload, data.file, chunked,
+                                              question_list + [instructions] if instructions else question_list)
+        profile, df = dataset["profile"], dataset["df"]
+
+    return {
+        "questions": questions,
+        "question_list": question_list,
+        "instructions": instructions,  # "" when the file is only questions
+        "urls": urls,
+        "pages": pages,
+        "profile": profile,
+        "df": df,  # None in chunked mode
+    }
+
+
+def _answer_locally(df: pd.DataFrame, questions: List[str]) -> Dict[int, str]:
+    """
+    Answers, by question index, for the questions confident_plan maps to
+    an exact plan: computed with pandas (shared aggregates once) and
+    phrased from templates. The rest are left to the LLM.
+    """
+    index, schema = column_index(df), schema_profile(df)
+    planned = []
+    for i, q in enumerate(questions):
+        plan = confident_plan(q, df, index, schema)
+        if plan is not None:
+            planned.append((i, plan))
+    if not planned:
+        return {}
+    results = execute_plans([plan for _, plan in planned], df, schema)
+    answers = {}
+    for (i, plan), result in zip(planned, results):
+        text = phrase_result(plan, result)
+        if text is not None:
+            answers[i] = text
+    return answers
+
+
+async def _local_answers(inputs: dict, enabled: bool) -> Dict[int, str]:
+    if not (enabled and API_LOCAL_ANSWERS) or inputs["df"] is None:
+        return {}
+    with span("local.answer"):
+        return await run_in_threadpool(_answer_locally, inputs["df"], inputs["question_list"])
+
+
+async def _context(inputs: dict, questions: List[str]) -> Tuple[str, str]:
+    """
+    (dataset summary, web context) for `questions`: only the columns they
+    mention, within PROFILE_TOKEN_BUDGET, and only the relevant page chunks.
+    """
+    dataset_summary = ""
+    if inputs["profile"] is not None:
+        with span("dataset.summary"):
+            dataset_summary = await run_in_threadpool(inputs["profile"].summary, questions)
+    web_context = ""
+    if inputs["pages"]:
+        with span("retrieval.context"):
+            web_context = build_context(questions, inputs["pages"])
+    return dataset_summary, web_context
+
+
+def _parse_reply(raw_text: str) -> Any:
+    """JSON value of an LLM reply, tolerating markdown code fences."""
+    if raw_text.startswith("```"):
+        raw_text = raw_text.strip("`")
+        raw_text = raw_text.split("\n", 1)[1] if "\n" in raw_text else raw_text
+    try:
+        return json.loads(raw_text)
+    except json.JSONDecodeError:
+        return raw_text
+
+
+@app.post("/")
+async def answer_questions(
+    questions_txt: UploadFile = File(...),
+    data: UploadFile = File(None),  # optional CSV
+    nocache: bool = False,  # ?nocache=true skips the LLM response cache
+    chunked: bool = False,  # ?chunked=true summarizes the CSV in bounded-memory chunks
+    local: bool = True  # ?local=false sends every question to the LLM
+):
+    inputs = await _read_inputs(questions_txt, data, chunked)
+    question_list = inputs["question_list"]
+
+    # Exactly computable questions are answered here. The LLM is skipped only
+    # when they are the whole file; otherwise it gets the file unchanged, with
+    # the local answers as known results, so no instruction is dropped.
+    answered = await _local_answers(inputs, local)
+    if answered and len(answered) == len(question_list) and not inputs["instructions"]:
+        return JSONResponse(content=[answered[i] for i in range(len(question_list))])
+    remaining = [q for i, q in enumerate(question_list) if i not in answered]
+    if inputs["instructions"]:
+        remaining.append(inputs["instructions"])
+    known = "\n".join(f"- {question_list[i]} -> {json.dumps(answer)}" for i, answer in sorted(answered.items()))
+    llm = get_llm(API_MODEL)
+    if llm.disabled:
+        return JSONResponse(status_code=503, content={
+            "error": "OPENAI_API_KEY not set: only questions with an exact local answer can be answered"})
+
+    dataset_summary, web_context = await _context(inputs, remaining)
 
     # --- Build prompt for LLM ---
     prompt = f"""
@@ -291,101 +455,105 @@ async def answer_questions(
     Dataset summary:
     {dataset_summary}
 
+    Web context (scraped from {", ".join(inputs["urls"]) or "N/A"}):
+    {web_context}
+
     Questions:
-    {questions}
+    {inputs["questions"]}
+
+    Known results (computed exactly; use these answers verbatim):
+    {known or "N/A"}
 
     Instructions:
-    - Answer the questions ONLY using the dataset summary above.
+    - Answer the questions ONLY using the dataset summary and web context above.
     - Return your answers in the SAME order as the questions.
     - Format the final output strictly as a valid JSON array: [a1, a2, a3, ...]
     - Do not include explanations, keys, or text outside the array.
     """
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
-from openai import OpenAI
-import re, json, io
-import pandas as pd
-
-client = OpenAI()
-app = FastAPI()
-
-# --- helper: extract first URL from text ---
-def extract_url(text: str) -> str | None:
-    match = re.search(r'(https?://\S+)', text)
 
-    return match.group(1) if match else None
+    # Call LLM (async: other requests keep running while we wait)
+    with bypass_cache(nocache):
+        raw_text = await llm.respond(prompt)
 
+    parsed = _parse_reply(raw_text)
+    if not isinstance(parsed, list):
+        parsed = [parsed]
+    if answered and len(parsed) == len(question_list):
+        parsed = [answered.get(i, a) for i, a in enumerate(parsed)]
 
-@app.post("/")
-async def answer_questions(
-    questions_txt: UploadFile = File(...),
-    data: UploadFile = File(None)  # optional CSV
-):
-    # Read uploaded questions
-    content_bytes = await questions_txt.read()
-    questions = content_bytes.decode("utf-8").strip()
-
-    # Detect URL in the question file (optional)
-    url = None
-    if questions.lower().startswith("url:"):
-        first_line, *rest = questions.splitlines()
-        url = first_line.split(":", 1)[1].strip()
-        questions = "\n".join(rest)
-    else:
-        url = extract_url(questions)
+    return JSONResponse(content=parsed)
 
-    # --- If CSV provided, summarize it ---
-    dataset_summary = ""
-    if data:
-        file_bytes = await data.read()
-        df = pd.read_csv(io.StringIO(file_bytes.decode("utf-8")))
-
-        # Summarize dataset (columns, dtypes, sample, stats)
-        dataset_summary = f"""
-        Columns: {list(df.columns)}
-        Data types: {df.dtypes.to_dict()}
-        Head:
-        {df.head(5).to_string(index=False)}
-        Summary stats:
-        {df.describe(include="all").to_string()}
-        """
 
-    # --- Build prompt for LLM ---
+async def _answer_one(inputs: dict, question: str, nocache: bool) -> Any:
+    dataset_summary, web_context = await _context(inputs, [question])
     prompt = f"""
-    You are a data analyst. 
+    You are a data analyst.
     Context: Here is the dataset summary and metadata.
     Dataset summary:
     {dataset_summary}
 
-    Questions:
-    {questions}
+    Web context (scraped from {", ".join(inputs["urls"]) or "N/A"}):
+    {web_context}
+
+    Question:
+    {question}
 
     Instructions:
-    - Answer the questions ONLY using the dataset summary above.
-    - Return your answers in the SAME order as the questions.
-    - Format the final output strictly as a valid JSON array: [a1, a2, a3, ...]
-    - Do not include explanations, keys, or text outside the array.
+    - Answer the question ONLY using the dataset summary and web context above.
+    - Format the output strictly as one valid JSON value (string, number, list or object).
+    - Do not include explanations or text outside that value.
     """
+    with bypass_cache(nocache):
+        return _parse_reply(await get_llm(API_MODEL).respond(prompt))
 
-    # Call LLM
-    response = client.responses.create(
-        model="gpt-4.1-mini",
-        input=prompt
-    )
 
-    raw_text = response.output[0].content[0].text.strip()
-
-    # Clean markdown code fences if any
-    if raw_text.startswith("```"):
-        raw_text = raw_text.strip("`")
-        raw_text = raw_text.split("\n", 1)[1] if "\n" in raw_text else raw_text
+async def _stream_answers(inputs: dict, nocache: bool, local: bool = True) -> AsyncIterator[str]:
+    """
+    One NDJSON line per question as soon as its answer is ready
+    ({"index", "question", "answer"} or {"index", "question", "error"}),
+    then {"answers": [...]} in question order (null where a question failed).
+    Locally computable questions come first, before any LLM call returns.
+    """
+    questions = inputs["question_list"]
+    answers: List[Any] = [None] * len(questions)
+    answered = await _local_answers(inputs, local)
+    for i, text in sorted(answered.items()):
+        answers[i] = text
+        yield json.dumps({"index": i, "question": questions[i], "answer": text}) + "\n"
+
+    async def answer(i: int, q: str) -> dict:
+        try:
+            return {"index": i, "question": q, "answer": await _answer_one(inputs, q, nocache)}
+        except Exception as e:
+            logger.warning("Streamed question %d failed: %s", i, e)
+            return {"index": i, "question": q, "error": str(e)}
 
-    # Parse JSON safely
+    tasks = [asyncio.ensure_future(answer(i, q)) for i, q in enumerate(questions) if i not in answered]
     try:
-        parsed = json.loads(raw_text)
-        if not isinstance(parsed, list):
-            parsed = [parsed]
-    except json.JSONDecodeError:
-        parsed = [raw_text]
-
-    return JSONResponse(content=parsed)
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            answers[item["index"]] = item.get("answer")
+            yield json.dumps(item) + "\n"
+        yield json.dumps({"answers": answers}) + "\n"
+    finally:
+        # Client went away: stop paying for answers nobody will read
+        for t in tasks:
+            t.cancel()
+
+
+@app.post("/stream")
+async def stream_answers(
+    questions_txt: UploadFile = File(...),
+    data: UploadFile = File(None),  # optional CSV
+    nocache: bool = False,
+    chunked: bool = False,
+    local: bool = True
+):
+    """
+    Same inputs as `POST /`, but each question is answered by its own LLM
+    call and streamed back as NDJSON the moment it completes (see
+    _stream_answers), so the first answer arrives after the fastest question
+    rather than the slowest.
+    """
+    inputs = await _read_inputs(questions_txt, data, chunked)
+    return StreamingResponse(_stream_answers(inputs, nocache, local), media_type="application/x-ndjson")
@@ -0,0 +1,279 @@
+# app/batch.py
+"""
+Batch mode of the CLI: many question/dataset jobs from a manifest, run on
+a process pool. Each worker imports the app once and keeps the datasets
+it has parsed, so jobs sharing a dataset do not parse it again. Every
+job writes its answers to <out_dir>/<id>.json as soon as it finishes;
+jobs whose output already exists are skipped, so an interrupted batch
+resumes where it stopped.
+
+    python -m app.main batch jobs.jsonl [--workers 4] [--out-dir batch_out]
+    python -m app.main batch "questions/*.txt" --csv sales.parquet
+
+Manifest lines are {"id": ..., "txt": ..., "csv": ...}: "id" defaults to
+the question file's stem, "csv" is optional and relative paths are
+resolved against the manifest's directory. With a glob, each question
+file is paired with a dataset of the same stem next to it (or --csv).
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from tqdm import tqdm
+
+from app import charts
+from app.core import process_inputs
+from app.io import DATASET_PROJECTION, load_csv_optional, load_txt, read_sample
+from app.qna import extract_questions, plan_projection
+from app.ratelimit import LLM_RPM, LLM_TPM, PRIORITY_BATCH, configure_rate_limiter, request_priority
+
+# --- Batch settings (overridable via env) ---
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Parsed datasets each worker keeps for later jobs (least recently used goes first)
+BATCH_WORKER_DATASETS = int(os.getenv("BATCH_WORKER_DATASETS", "2"))
+
+# Extensions tried, in order, when pairing a globbed question file with its dataset
+_DATASET_SUFFIXES = (".csv", ".csv.gz", ".csv.zst", ".parquet", ".feather", ".arrow", ".arrows")
+STATUS_LOG = "batch.jsonl"
+
+# Per-process: datasets parsed by this worker, keyed by (path, columns)
+_datasets: "OrderedDict[Tuple[str, Optional[tuple]], Any]" = OrderedDict()
+
+
+def _resolve(path: Optional[str], base: Path) -> Optional[str]:
+    if not path:
+        return None
+    p = Path(path).expanduser()
+    return str(p if p.is_absolute() else base / p)
+
+
+def _paired_dataset(txt: Path) -> Optional[str]:
+    for suffix in _DATASET_SUFFIXES:
+        candidate = txt.parent / f"{txt.stem}{suffix}"
+        if candidate.exists():
+            return str(candidate)
+    return None
+
+
+def load_manifest(spec: str, csv: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Jobs [{"id", "txt", "csv"}] from a JSONL manifest or a glob of
+    question files. `csv` is the dataset of jobs that name none.
+    Raises ValueError on malformed lines or duplicate ids.
+    """
+    jobs: List[Dict[str, Any]] = []
+    path = Path(spec)
+    if path.is_file() and path.suffix in (".jsonl", ".ndjson"):
+        base = path.resolve().parent
+        with open(path, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{spec}:{n}: {e}") from None
+                if not isinstance(entry, dict) or not entry.get("txt"):
+                    raise ValueError(f"{spec}:{n}: each job needs a \"txt\" path")
+                txt = _resolve(entry["txt"], base)
+                jobs.append({
+                    "id": str(entry.get("id") or Path(txt).stem),
+                    "txt": txt,
+                    "csv": _resolve(entry.get("csv") or entry.get("data"), base) or csv,
+                })
+    else:
+        for txt in sorted(glob.glob(spec, recursive=True)):
+            p = Path(txt)
+            jobs.append({"id": p.stem, "txt": str(p), "csv": _paired_dataset(p) or csv})
+        if not jobs:
+            raise ValueError(f"No question files match {spec!r}")
+
+    seen = set()
+    for job in jobs:
+        if job["id"] in seen or "/" in job["id"] or "\\" in job["id"]:
+            raise ValueError(f"Job id {job['id']!r} is duplicated or not a file name; set ids in a JSONL manifest")
+        seen.add(job["id"])
+    return jobs
+
+
+def _projections(jobs: Sequence[Dict[str, Any]]) -> Dict[str, Optional[tuple]]:
+    """
+    Columns to parse per dataset: the union of every job's plan on that
+    dataset (see qna.plan_projection), or None to parse all of them.
+    """
+    by_dataset: Dict[str, List[Dict[str, Any]]] = {}
+    for job in jobs:
+        if job["csv"]:
+            by_dataset.setdefault(job["csv"], []).append(job)
+    if not DATASET_PROJECTION:
+        return {path: None for path in by_dataset}
+
+    out: Dict[str, Optional[tuple]] = {}
+    for path, group in by_dataset.items():
+        try:
+            sample = read_sample(path)
+        except Exception:
+            out[path] = None  # the job reports the real error when it loads the file
+            continue
+        keep: Optional[set] = set()
+        for job in group:
+            try:
+                text = load_txt(job["txt"])
+                columns = plan_projection(extract_questions(text) or [text], sample)
+            except Exception:
+                columns = None  # the job reports the error when it runs
+            if columns is None:
+                keep = None
+                break
+            keep.update(columns)
+        out[path] = None if keep is None else tuple(c for c in sample.columns if c in keep)
+    return out
+
+
+def _dataset(path: str, columns: Optional[tuple]):
+    """This worker's parse of `path`, made on first use."""
+    key = (path, columns)
+    df = _datasets.get(key)
+    if df is None:
+        df = load_csv_optional(path, columns=list(columns) if columns is not None else None)
+        _datasets[key] = df
+        while len(_datasets) > max(BATCH_WORKER_DATASETS, 1):
+            _datasets.popitem(last=False)
+    else:
+        _datasets.move_to_end(key)
+    return df
+
+
+def _write_json(path: Path, data: Any) -> None:
+    """Write atomically: a crash never leaves a partial output that looks done."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _init_worker(workers: int) -> None:
+    # Charts render inside each worker: the workers are the parallelism
+    charts.CHART_WORKERS = 0
+    # LLM_RPM / LLM_TPM are per process: split the quota between the workers
+    configure_rate_limiter(rpm=LLM_RPM / workers, tpm=LLM_TPM / workers)
+
+
+def run_job(job: Dict[str, Any], out_dir: str, columns: Optional[tuple] = None,
+            concurrency: Optional[int] = None, use_cache: bool = True,
+            per_question: bool = False) -> Dict[str, Any]:
+    """Answer one job and write <out_dir>/<id>.json. Returns its status line."""
+    t0 = time.perf_counter()
+    try:
+        text = load_txt(job["txt"])
+        df = _dataset(job["csv"], columns) if job["csv"] else None
+        with request_priority(PRIORITY_BATCH):
+            _, answers = process_inputs(text, df, max_concurrency=concurrency,
+                                        batched=not per_question, use_cache=use_cache)
+        _write_json(Path(out_dir) / f"{job['id']}.json", answers)
+        status = {"status": "ok"}
+    except Exception as e:
+        status = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    return {"id": job["id"], **status, "seconds": round(time.perf_counter() - t0, 3), "pid": os.getpid()}
+
+
+def run_batch(
+    jobs: Sequence[Dict[str, Any]],
+    out_dir: str,
+    workers: int = BATCH_WORKERS,
+    concurrency: Optional[int] = None,
+    use_cache: bool = True,
+    force: bool = False,
+    per_question: bool = False
+) -> Dict[str, int]:
+    """
+    Run `jobs` on `workers` processes (in this process when workers <= 1)
+    and append one status line per job to <out_dir>/batch.jsonl. Jobs
+    with an output file already are skipped unless `force`. `concurrency`
+    only applies with `per_question` (see core.process_inputs_async).
+    Returns {"done", "failed", "skipped"}.
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    pending = [j for j in jobs if force or not (out / f"{j['id']}.json").exists()]
+    counts = {"done": 0, "failed": 0, "skipped": len(jobs) - len(pending)}
+    if not pending:
+        return counts
+
+    # Jobs on the same dataset go out together, so a worker's parse is reused
+    pending.sort(key=lambda j: (j["csv"] or "", j["id"]))
+    columns = _projections(pending)
+    workers = max(min(workers, len(pending)), 1)
+
+    with open(out / STATUS_LOG, "a", encoding="utf-8") as log, \
+            tqdm(total=len(pending), unit="job", desc="batch") as bar:
+        def record(status: Dict[str, Any]) -> None:
+            counts["done" if status["status"] == "ok" else "failed"] += 1
+            log.write(json.dumps(status) + "\n")
+            log.flush()
+            bar.set_postfix(failed=counts["failed"], refresh=False)
+            bar.update()
+
+        if workers == 1:
+            for job in pending:
+                record(run_job(job, str(out), columns.get(job["csv"]), concurrency, use_cache, per_question))
+            return counts
+
+        # spawn, not fork: like the chart pool, avoid inheriting threads/locks
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(workers,)) as pool:
+            # Keep only a couple of jobs per worker queued, in dataset order
+            queue = iter(pending)
+            running: Dict[Any, Dict[str, Any]] = {}
+
+            def submit() -> None:
+                job = next(queue, None)
+                if job is not None:
+                    running[pool.submit(run_job, job, str(out), columns.get(job["csv"]),
+                                        concurrency, use_cache, per_question)] = job
+
+            for _ in range(workers * 2):
+                submit()
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as e:  # worker died (OOM, kill)
+                        status = {"id": job["id"], "status": "error", "error": f"{type(e).__name__}: {e}"}
+                    record(status)
+                    submit()
+    return counts
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.main batch",
+                                     description="Answer many question files, in parallel and resumably.")
+    parser.add_argument("manifest", help="JSONL manifest of {id, txt, csv} jobs, or a glob of question files")
+    parser.add_argument("--csv", help="dataset for jobs that do not name one")
+    parser.add_argument("--out-dir", default="batch_out", help="where <id>.json answers and batch.jsonl go")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="worker processes (default BATCH_WORKERS)")
+    parser.add_argument("--per-question", action="store_true",
+                        help="one set of LLM calls per question instead of a few batched calls per job")
+    parser.add_argument("--concurrency", type=int,
+                        help="with --per-question, questions answered in parallel per job (default CORE_FANOUT)")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the LLM response cache")
+    parser.add_argument("--force", action="store_true", help="rerun jobs that already have an output")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_manifest(args.manifest, args.csv)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    counts = run_batch(jobs, args.out_dir, args.workers, args.concurrency,
+                       use_cache=not args.no_cache, force=args.force, per_question=args.per_question)
+    print(json.dumps(counts))
+    return 1 if counts["failed"] else 0
@@ -0,0 +1,166 @@
+# app/charts.py
+"""
+Chart rendering off the request path.
+
+Charts are described by plain-data specs and rendered with matplotlib's
+object-oriented API (Figure + Agg canvas, no pyplot global state) in a
+small process pool, so PNG encoding neither holds the request thread's
+GIL nor races other renders. Keep this module free of pandas imports:
+the worker processes load only it, app.metrics and numpy (the app
+package defers its re-exports so that app/__init__ stays light).
+"""
+import base64
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.metrics import timed
+
+# --- Rendering settings (overridable via env) ---
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))  # 0 renders in the calling thread
+CHART_DPI = int(os.getenv("CHART_DPI", "100"))
+CHART_WIDTH = float(os.getenv("CHART_WIDTH", "6.4"))  # inches
+CHART_HEIGHT = float(os.getenv("CHART_HEIGHT", "4.8"))  # inches
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+
+_pool: Optional[Executor] = None
+_pool_lock = threading.Lock()
+
+
+def downsample(x: Sequence, y: Sequence, max_points: int = CHART_MAX_POINTS) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep every n-th point so at most `max_points` are plotted (first and last kept)."""
+    x, y = np.asarray(x), np.asarray(y)
+    if max_points <= 0 or len(x) <= max_points:
+        return x, y
+    idx = np.linspace(0, len(x) - 1, max_points).astype(np.int64)
+    return x[idx], y[idx]
+
+
+def decimate_minmax(x: Sequence, y: Sequence, buckets: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce an x-sorted series to the min and max point of each of `buckets`
+    equal-count buckets, in x order. At one bucket per pixel column the
+    plot looks the same as the full series (spikes are kept, unlike
+    striding). Non-numeric y falls back to `downsample`.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    n = len(y)
+    if buckets <= 0 or n <= 2 * buckets:
+        return x, y
+    if not np.issubdtype(y.dtype, np.number):
+        return downsample(x, y, 2 * buckets)
+
+    yf = y.astype(np.float64, copy=False)
+    size = -(-n // buckets)  # ceil
+    full = n // size
+    body = yf[: full * size].reshape(full, size)
+    offsets = np.arange(full) * size
+    lo = np.where(np.isnan(body), np.inf, body).argmin(axis=1) + offsets
+    hi = np.where(np.isnan(body), -np.inf, body).argmax(axis=1) + offsets
+    idx = [lo, hi]
+    if full * size < n:
+        tail = yf[full * size:]
+        idx.append(np.array([np.nanargmin(tail) if not np.isnan(tail).all() else 0,
+                             np.nanargmax(tail) if not np.isnan(tail).all() else len(tail) - 1]) + full * size)
+    idx = np.unique(np.concatenate(idx))
+    return x[idx], y[idx]
+
+
+def _render(spec: Dict[str, Any]) -> str:
+    """Render one chart spec to a PNG data URI. Runs inside pool workers."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(spec.get("width", CHART_WIDTH), spec.get("height", CHART_HEIGHT)))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    if spec["kind"] == "bar":
+        labels = [str(v) for v in spec["labels"]]
+        ax.bar(range(len(labels)), spec["values"])
+        ax.set_xticks(range(len(labels)), labels, rotation=90)
+    elif spec["kind"] == "line":
+        ax.plot(spec["x"], spec["y"])
+        fig.autofmt_xdate()
+    else:
+        raise ValueError(f"Unknown chart kind: {spec['kind']}")
+
+    if spec.get("xlabel") is not None:
+        ax.set_xlabel(str(spec["xlabel"]))
+    if spec.get("ylabel") is not None:
+        ax.set_ylabel(str(spec["ylabel"]))
+    if spec.get("title"):
+        ax.set_title(spec["title"])
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight", dpi=spec.get("dpi", CHART_DPI))
+    data = base64.b64encode(buf.getvalue()).decode("utf-8")
+    return f"data:image/png;base64,{data}"
+
+
+def _prepare(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply the point budget before the spec is shipped to a worker: line
+    series are decimated to one min/max pair per horizontal pixel, capped
+    at CHART_MAX_POINTS points.
+    """
+    if spec["kind"] == "line":
+        pixels = int(spec.get("width", CHART_WIDTH) * spec.get("dpi", CHART_DPI))
+        max_points = spec.get("max_points", CHART_MAX_POINTS)
+        buckets = min(pixels, max_points // 2) if max_points > 0 else pixels
+        x, y = decimate_minmax(spec["x"], spec["y"], buckets)
+        spec = {**spec, "x": x, "y": y}
+    return spec
+
+
+def get_chart_pool() -> Optional[Executor]:
+    """Lazily started render pool; None when CHART_WORKERS=0."""
+    global _pool
+    if CHART_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the API process has threads and an event loop
+                _pool = ProcessPoolExecutor(
+                    max_workers=CHART_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+@timed("chart.render")
+def render_chart(spec: Dict[str, Any]) -> str:
+    """Render a chart spec, blocking the calling thread (not the pool) until done."""
+    spec = _prepare(spec)
+    pool = get_chart_pool()
+    if pool is None:
+        return _render(spec)
+    try:
+        return pool.submit(_render, spec).result()
+    except BrokenProcessPool:
+        # A worker died (OOM, kill); start a fresh pool next time
+        _discard_pool(pool)
+        return _render(spec)
+
+
+def _discard_pool(pool: Executor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_chart_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -1,54 +1,178 @@
 # app/core.py
+import asyncio
+import os
 from typing import Optional, List, Dict, Any, Tuple
 import pandas as pd
 
-from app.qna import extract_questions, classify_question as heuristic_classify, plan_csv_op as heuristic_plan
-from app.csv_ops import execute_plan
-from app.web import scrape_website
+from app.schema import SchemaProfile, schema_profile
+from app.qna import extract_questions, column_index, classify_question as heuristic_classify, plan_csv_op as heuristic_plan
+from app.csv_ops import execute_plan, execute_plans, validate_plan
+from app.web import extract_urls, scrape_many
+from app.retrieval import BM25Index, build_context, get_index
 
-from app.llm import LLMClient
+from app.llm import LLMClient, get_llm, run_sync
+from app.metrics import span
 
+# How many questions are worked on at once (LLMClient still caps in-flight calls)
+CORE_FANOUT = int(os.getenv("CORE_FANOUT", "8"))
 
-def process_inputs(
+
+async def _answer_question(
+    q: str,
+    df: Optional[pd.DataFrame],
+    schema: Optional[SchemaProfile],
+    pages: List[BM25Index],
+    llm: LLMClient
+) -> str:
+    """
+    Route one question to CSV or Web and return its answer.
+    """
+    # --- Step 1: Classify route
+    if llm.disabled:
+        route = heuristic_classify(q, df is not None, column_index(df) if df is not None else None)
+    else:
+        route = await llm.classify_route(q, df is not None, list(df.columns) if df is not None else None)
+
+    # --- Step 2: CSV route
+    if route == "csv" and df is not None:
+        plan = heuristic_plan(q, df, schema=schema)
+        if not llm.disabled:
+            plan_llm = await llm.map_to_csv_plan(q, list(df.columns), schema)
+            if plan_llm:
+                plan = plan_llm
+
+        # Plans may render charts; keep that work off the event loop
+        result = await asyncio.to_thread(execute_plan, plan, df, schema)
+        final = await llm.phrase_csv_answer(q, result["summary"], result.get("metrics", {})) \
+            if not llm.disabled else result["summary"]
+        return str(final)
+
+    # --- Step 3: Web route
+    context = build_context([q], pages)  # most relevant chunks within the token budget
+    final = await llm.answer_with_context(q, context) if not llm.disabled else "No LLM available"
+    return str(final)
+
+
+async def _answer_batched(
+    questions: List[str],
+    df: Optional[pd.DataFrame],
+    schema: Optional[SchemaProfile],
+    pages: List[BM25Index],
+    llm: LLMClient
+) -> List[str]:
+    """
+    Batched pipeline: one call classifies and plans every question, then
+    CSV answers are phrased in one call and web answers in another.
+    Anything the LLM skips or gets wrong falls back to the heuristics.
+    """
+    columns = list(df.columns) if df is not None else None
+    index = column_index(df) if df is not None else None
+
+    # --- Stage 1: route + plan all questions at once
+    routed = await llm.plan_questions(questions, columns, schema)
+
+    csv_plans: List[Dict[str, Any]] = []
+    csv_idx: List[int] = []
+    web_idx: List[int] = []
+    for i, (q, item) in enumerate(zip(questions, routed)):
+        route = item["route"] if item else heuristic_classify(q, df is not None, index)
+        if route == "csv" and df is not None:
+            plan = item.get("plan") if item else None
+            if not validate_plan(plan, columns, schema):
+                plan = heuristic_plan(q, df, index, schema)
+            csv_plans.append(plan)
+            csv_idx.append(i)
+        else:
+            web_idx.append(i)
+
+    # Shared sums/groupbys across questions are computed once
+    results = await asyncio.to_thread(execute_plans, csv_plans, df, schema) if csv_plans else []
+    csv_items = [
+        {"question": questions[i], "summary": r["summary"], "metrics": r.get("metrics", {})}
+        for i, r in zip(csv_idx, results)
+    ]
+
+    # --- Stage 2: phrase CSV results and answer web questions (concurrently)
+    async def answer_web() -> List[str]:
+        if not web_idx:
+            return []
+        web_qs = [questions[i] for i in web_idx]
+        context = build_context(web_qs, pages)  # shared budget, split across the questions
+        got = await llm.aask(web_qs, context)
+        if isinstance(got, list) and len(got) == len(web_qs):
+            return [str(a) for a in got]
+        return [str(a) for a in await asyncio.gather(
+            *(llm.answer_with_context(q, build_context([q], pages)) for q in web_qs)
+        )]
+
+    csv_answers, web_answers = await asyncio.gather(llm.phrase_csv_answers(csv_items), answer_web())
+
+    answers = [""] * len(questions)
+    for i, a in zip(csv_idx, csv_answers):
+        answers[i] = a
+    for i, a in zip(web_idx, web_answers):
+        answers[i] = a
+    return answers
+
+
+async def process_inputs_async(
     questions_text: str,
     df: Optional[pd.DataFrame] = None,
-    url: Optional[str] = None
+    url: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    batched: bool = True,
+    use_cache: bool = True
 ) -> Tuple[List[str], List[str]]:
     """
-    Main orchestrator: classify, route to CSV or Web, get answers.
-    Returns (questions, answers_list).
+    Async orchestrator. By default all questions are classified, planned
+    and phrased in a couple of batched LLM calls; with batched=False each
+    question runs its own calls, at most `max_concurrency` at a time
+    (default CORE_FANOUT). Answers are returned in question order.
+    use_cache=False skips the LLM response cache for this run.
+    The LLM client (and its warm connections) is shared process-wide.
     """
-    llm = LLMClient()
-    questions = extract_questions(questions_text)
-    answers: List[str] = []
+    llm = get_llm(use_cache=use_cache)
+    with span("questions.extract"):
+        questions = extract_questions(questions_text)
 
-    # If a URL is given, scrape it once
-    scraped_text = scrape_website(url) if url else ""
+    # Scrape the given URL, or every URL in the question file, concurrently
+    urls = [url] if url else extract_urls(questions_text)
+    texts = await scrape_many(urls) if urls else []
+    # Chunk + index each page once (cached per URL) for per-question retrieval
+    with span("retrieval.index"):
+        pages = [get_index(u, t) for u, t in zip(urls, texts)]
+    # Column types and roles, computed once for all questions
+    with span("dataset.schema"):
+        schema = await asyncio.to_thread(schema_profile, df) if df is not None else None
 
-    for q in questions:
-        # --- Step 1: Classify route
-        if llm.disabled:
-            route = heuristic_classify(q, df is not None)
-        else:
-            route = llm.classify_route(q, df is not None, list(df.columns) if df is not None else None)
+    fanout = asyncio.Semaphore(max_concurrency or CORE_FANOUT)
 
-        # --- Step 2: CSV route
-        if route == "csv" and df is not None:
-            plan = heuristic_plan(q, df)
-            if not llm.disabled:
-                plan_llm = llm.map_to_csv_plan(q, list(df.columns))
-                if plan_llm:
-                    plan = plan_llm
-
-            result = execute_plan(plan, df)
-            final = llm.phrase_csv_answer(q, result["summary"], result.get("metrics", {})) \
-                if not llm.disabled else result["summary"]
-            answers.append(str(final))
-
-        # --- Step 3: Web route
+    async def run(q: str) -> str:
+        async with fanout:
+            return await _answer_question(q, df, schema, pages, llm)
+
+    with span("core.answer"):
+        if batched and not llm.disabled:
+            answers = await _answer_batched(questions, df, schema, pages, llm)
         else:
-            context = scraped_text[:4000]  # truncate to avoid token limits
-            final = llm.answer_with_context(q, context) if not llm.disabled else "No LLM available"
-            answers.append(str(final))
+            answers = await asyncio.gather(*(run(q) for q in questions))
+    return questions, list(answers)
+
 
-    return questions, answers
+def process_inputs(
+    questions_text: str,
+    df: Optional[pd.DataFrame] = None,
+    url: Optional[str] = None,
+    parallel: bool = True,
+    max_concurrency: Optional[int] = None,
+    batched: bool = True,
+    use_cache: bool = True
+) -> Tuple[List[str], List[str]]:
+    """
+    Main orchestrator: classify, route to CSV or Web, get answers.
+    Returns (questions, answers_list).
+    With parallel=False questions are answered one at a time.
+    Runs on the shared background loop, so repeated calls reuse connections.
+    """
+    width = (max_concurrency or CORE_FANOUT) if parallel else 1
+    return run_sync(process_inputs_async(questions_text, df, url, max_concurrency=width, batched=batched, use_cache=use_cache))
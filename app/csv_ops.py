@@ -1,17 +1,214 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import base64
-import io
-from typing import Dict, Any
-
-def _plot_to_base64(fig) -> str:
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight")
-    plt.close(fig)
-    data = base64.b64encode(buf.getvalue()).decode("utf-8")
-    return f"data:image/png;base64,{data}"
-
-def execute_plan(plan: Dict[str, Any], df: pd.DataFrame) -> Dict[str, Any]:
+from typing import Dict, Any, List, Optional
+
+from app.charts import render_chart
+from app.metrics import timed
+from app.schema import SchemaProfile
+
+# Plan kinds understood by execute_plan and the column keys each one needs
+PLAN_KINDS: Dict[str, tuple] = {
+    "count_rows": (),
+    "sum": ("col",),
+    "mean": ("col",),
+    "median": ("col",),
+    "count_distinct": ("col",),
+    "correlation": ("col_x", "col_y"),
+    "group_sum_top": ("group_col", "sum_col"),
+    "top_k": ("group_col", "sum_col"),
+    "filtered_agg": ("filter_col",),
+    "bar_chart": ("x", "y"),
+    "line_chart": ("x", "y"),
+}
+# Column keys that must name a numeric column
+_NUMERIC_KEYS = frozenset({"col", "col_x", "col_y", "sum_col", "y"})
+# Allowed values of non-column plan parameters (first one is the default)
+_PLAN_PARAMS: Dict[str, Dict[str, tuple]] = {
+    "filtered_agg": {"agg": ("sum", "mean", "median", "count")},
+    "top_k": {"agg": ("sum", "mean"), "order": ("desc", "asc")},
+}
+_TOP_K_DEFAULT = 3
+_TOP_K_MAX = 100
+
+def _param(plan: Dict[str, Any], name: str) -> Any:
+    return plan.get(name) or _PLAN_PARAMS[plan["kind"]][name][0]
+
+def _column_keys(plan: Dict[str, Any]) -> tuple:
+    """Column keys `plan` must carry (filtered counts need no value column)."""
+    keys = PLAN_KINDS[plan["kind"]]
+    if plan["kind"] == "filtered_agg" and _param(plan, "agg") != "count":
+        keys += ("col",)
+    return keys
+
+def plan_columns(plan: Dict[str, Any]) -> List[Any]:
+    """Columns a valid `plan` reads."""
+    return [plan[k] for k in _column_keys(plan) if plan.get(k) is not None]
+
+def _numeric_keys(plan: Dict[str, Any]) -> frozenset:
+    return frozenset() if plan.get("kind") == "count_distinct" else _NUMERIC_KEYS
+
+def _param_error(plan: Dict[str, Any]) -> Optional[str]:
+    """Why a plan's non-column parameters are invalid, or None."""
+    for name, allowed in _PLAN_PARAMS.get(plan["kind"], {}).items():
+        if plan.get(name) is not None and plan[name] not in allowed:
+            return f"{name} must be one of {', '.join(allowed)}"
+    if plan["kind"] == "filtered_agg" and plan.get("value") is None:
+        return "filtered_agg needs a filter value"
+    if plan["kind"] == "top_k":
+        k = plan.get("k", _TOP_K_DEFAULT)
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= _TOP_K_MAX:
+            return f"k must be an integer from 1 to {_TOP_K_MAX}"
+    return None
+
+def validate_plan(
+    plan: Any,
+    columns: Optional[List[str]] = None,
+    schema: Optional[SchemaProfile] = None
+) -> bool:
+    """
+    True if `plan` is a known kind with all its column keys present
+    (and, when `columns` is given, naming real columns; when `schema` is
+    given, aggregating only numeric columns).
+    """
+    if not isinstance(plan, dict) or plan.get("kind") not in PLAN_KINDS:
+        return False
+    if _param_error(plan):
+        return False
+    for key in _column_keys(plan):
+        if key not in plan:
+            return False
+        if columns is not None and plan[key] not in columns:
+            return False
+    return schema is None or _type_error(plan, schema) is None
+
+def _type_error(plan: Dict[str, Any], schema: SchemaProfile) -> Optional[str]:
+    """Why `plan` cannot run against `schema`, or None if it can."""
+    if plan.get("kind") not in PLAN_KINDS:
+        return None
+    error = _param_error(plan)
+    if error:
+        return error
+    numeric = _numeric_keys(plan)
+    for key in _column_keys(plan):
+        col = plan.get(key)
+        if col not in schema.kinds:
+            return f"unknown column {col!r}"
+        if key in numeric and not schema.is_numeric(col):
+            return f"column {col!r} is not numeric"
+    return None
+
+def _needs(plan: Dict[str, Any]) -> List[tuple]:
+    """Shared aggregates a plan reads, as hashable keys."""
+    kind = plan.get("kind")
+    if kind in ("sum", "mean", "median"):
+        return [(kind, plan["col"])]
+    if kind == "count_distinct":
+        return [("nunique", plan["col"])]
+    if kind == "correlation":
+        return [("corr", plan["col_x"], plan["col_y"])]
+    if kind == "group_sum_top":
+        return [("group_sum", plan["group_col"], plan["sum_col"])]
+    if kind == "top_k":
+        return [(f"group_{_param(plan, 'agg')}", plan["group_col"], plan["sum_col"])]
+    if kind == "filtered_agg":
+        agg = _param(plan, "agg")
+        return [("filter", plan["filter_col"], plan["value"], agg, plan["col"] if agg != "count" else None)]
+    if kind == "bar_chart":
+        return [("group_sum", plan["x"], plan["y"])]
+    return []
+
+def _evaluate(needs: set, df: pd.DataFrame) -> Dict[tuple, Any]:
+    """
+    Compute each distinct aggregate once: one vectorized call per column
+    reduction and one groupby pass per distinct group key.
+    Failures are stored as the exception so only plans using them fail.
+    """
+    values: Dict[tuple, Any] = {}
+
+    def each(keys, fn):
+        for key in keys:
+            try:
+                values[key] = fn(key)
+            except Exception as e:
+                values[key] = e
+
+    # Column reductions (sum, mean, median) over all requested columns at once
+    for red in ("sum", "mean", "median"):
+        keys = [k for k in needs if k[0] == red]
+        if not keys:
+            continue
+        cols = sorted({k[1] for k in keys}, key=str)
+        try:
+            res = getattr(df[cols], red)()
+            for k in keys:
+                values[k] = res[k[1]]
+        except Exception:
+            each(keys, lambda k: getattr(df[k[1]], red)())
+
+    # Group sums/means: every value column for the same key and op in one groupby
+    by_group: Dict[tuple, List[tuple]] = {}
+    for k in needs:
+        if k[0] in ("group_sum", "group_mean"):
+            by_group.setdefault((k[1], k[0][6:]), []).append(k)
+    for (group_col, op), keys in by_group.items():
+        cols = sorted({k[2] for k in keys}, key=str)
+        try:
+            table = getattr(df.groupby(group_col, observed=True)[cols], op)()
+            for k in keys:
+                values[k] = table[k[2]]
+        except Exception:
+            each(keys, lambda k: getattr(df.groupby(k[1], observed=True)[k[2]], op)())
+
+    each([k for k in needs if k[0] == "nunique"], lambda k: df[k[1]].nunique())
+    each([k for k in needs if k[0] == "corr"], lambda k: df[k[1]].corr(df[k[2]]))
+
+    # Filtered aggregates: one mask per (column, value)
+    masks: Dict[tuple, Any] = {}
+
+    def filtered(k):
+        if (k[1], k[2]) not in masks:
+            masks[k[1], k[2]] = _filter_mask(df[k[1]], k[2])
+        mask = masks[k[1], k[2]]
+        if k[3] == "count":
+            return int(mask.sum())
+        return getattr(df.loc[mask, k[4]], k[3])()
+
+    each([k for k in needs if k[0] == "filter"], filtered)
+    return values
+
+def _filter_mask(s: pd.Series, value: Any) -> pd.Series:
+    """Rows where `s` equals `value` (numbers numerically, text ignoring case)."""
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s == float(value)
+    target = str(value).strip().lower()
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.isin([c for c in s.cat.categories if str(c).strip().lower() == target])
+    return s.astype("string").str.strip().str.lower() == target
+
+def _line_series(df: pd.DataFrame, x_col: str, y_col: str):
+    """
+    Sorted (x, y) arrays for a time-series plot. Only the two columns are
+    touched (no frame copy); an x column already parsed as datetime at
+    load time is used as-is. Decimation happens in charts.render_chart.
+    """
+    x = df[x_col]
+    if not pd.api.types.is_datetime64_any_dtype(x):
+        x = pd.to_datetime(x, errors="coerce")
+    keep = x.notna().to_numpy()
+    xv = x.to_numpy()[keep]
+    yv = df[y_col].to_numpy()[keep]
+    if not x[keep].is_monotonic_increasing:
+        order = np.argsort(xv, kind="stable")
+        xv, yv = xv[order], yv[order]
+    return xv, yv
+
+def _get(values: Dict[tuple, Any], key: tuple) -> Any:
+    value = values[key]
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+def _result(plan: Dict[str, Any], df: pd.DataFrame, values: Dict[tuple, Any]) -> Dict[str, Any]:
     kind = plan.get("kind")
     try:
         if kind == "count_rows":
@@ -19,42 +216,167 @@ def execute_plan(plan: Dict[str, Any], df: pd.DataFrame) -> Dict[str, Any]:
 
         if kind == "sum":
             col = plan["col"]
-            total = df[col].sum()
+            total = _get(values, ("sum", col))
             return {"summary": f"Total {col}: {total}", "metrics": {"total": total}}
 
+        if kind == "mean":
+            col = plan["col"]
+            mean = _get(values, ("mean", col))
+            return {"summary": f"Mean {col}: {mean}", "metrics": {"mean": mean}}
+
+        if kind == "count_distinct":
+            col = plan["col"]
+            n = _get(values, ("nunique", col))
+            return {"summary": f"Distinct {col}: {n}", "metrics": {"distinct": n}}
+
         if kind == "group_sum_top":
             group_col, sum_col = plan["group_col"], plan["sum_col"]
-            grouped = df.groupby(group_col)[sum_col].sum()
+            grouped = _get(values, ("group_sum", group_col, sum_col))
             top_val = grouped.idxmax()
-            return {"summary": f"Top {group_col}: {top_val}", "metrics": {"top": top_val}}
+            return {"summary": f"Top {group_col}: {top_val}", "metrics": {"top": top_val, "value": grouped[top_val]}}
+
+        if kind == "top_k":
+            agg, order = _param(plan, "agg"), _param(plan, "order")
+            k = plan.get("k", _TOP_K_DEFAULT)
+            grouped = _get(values, (f"group_{agg}", plan["group_col"], plan["sum_col"]))
+            top = grouped.nsmallest(k) if order == "asc" else grouped.nlargest(k)
+            listed = ", ".join(f"{label} ({value})" for label, value in top.items())
+            return {
+                "summary": f"{'Bottom' if order == 'asc' else 'Top'} {k} {plan['group_col']} by {agg} {plan['sum_col']}: {listed}",
+                "metrics": {"top": [[label, value] for label, value in top.items()]},
+            }
+
+        if kind == "filtered_agg":
+            agg, col = _param(plan, "agg"), plan.get("col")
+            key = ("filter", plan["filter_col"], plan["value"], agg, col if agg != "count" else None)
+            value = _get(values, key)
+            where = f"{plan['filter_col']} = {plan['value']}"
+            what = "Rows" if agg == "count" else f"{agg.capitalize()} {col}"
+            return {"summary": f"{what} where {where}: {value}", "metrics": {agg: value}}
 
         if kind == "correlation":
             col_x, col_y = plan["col_x"], plan["col_y"]
-            corr = df[col_x].corr(df[col_y])
+            corr = _get(values, ("corr", col_x, col_y))
             return {"summary": f"Correlation between {col_x} and {col_y}: {corr:.3f}", "metrics": {"correlation": corr}}
 
         if kind == "median":
             col = plan["col"]
-            med = df[col].median()
+            med = _get(values, ("median", col))
             return {"summary": f"Median {col}: {med}", "metrics": {"median": med}}
 
         if kind == "bar_chart":
-            fig, ax = plt.subplots()
-            df.groupby(plan["x"])[plan["y"]].sum().plot(kind="bar", ax=ax)
-            img = _plot_to_base64(fig)
+            grouped = _get(values, ("group_sum", plan["x"], plan["y"]))
+            img = render_chart({
+                "kind": "bar", "labels": grouped.index.tolist(), "values": grouped.to_numpy(),
+                "xlabel": plan["x"],
+            })
             return {"summary": "Generated bar chart.", "metrics": {"chart": img}}
 
         if kind == "line_chart":
-            fig, ax = plt.subplots()
-            temp = df.copy()
-            temp[plan["x"]] = pd.to_datetime(temp[plan["x"]], errors="coerce")
-            temp = temp.dropna(subset=[plan["x"]])
-            temp = temp.sort_values(plan["x"])
-            ax.plot(temp[plan["x"]], temp[plan["y"]])
-            img = _plot_to_base64(fig)
+            x, y = _line_series(df, plan["x"], plan["y"])
+            img = render_chart({"kind": "line", "x": x, "y": y})
             return {"summary": "Generated line chart.", "metrics": {"chart": img}}
 
         return {"summary": "Plan not recognized.", "metrics": {}}
 
     except Exception as e:
         return {"summary": f"Could not execute plan: {str(e)}", "metrics": {}}
+
+@timed("csv.execute")
+def execute_plans(
+    plans: List[Dict[str, Any]],
+    df: pd.DataFrame,
+    schema: Optional[SchemaProfile] = None
+) -> List[Dict[str, Any]]:
+    """
+    Run all plans of a request together. Aggregates shared between plans
+    (the same column sum, the same groupby key) are computed once, so cost
+    grows with the number of distinct groupby keys, not the number of plans.
+    With a `schema`, plans that would aggregate non-numeric columns are
+    rejected up front instead of scanning the data.
+    Results come back in plan order.
+    """
+    errors = [_type_error(plan, schema) if schema is not None and isinstance(plan, dict) else None
+              for plan in plans]
+    needs = set()
+    for plan, error in zip(plans, errors):
+        if error:
+            continue
+        try:
+            needs.update(_needs(plan))
+        except Exception:
+            pass  # malformed plan; _result reports it
+    values = _evaluate(needs, df)
+    return [
+        {"summary": f"Could not execute plan: {error}", "metrics": {}} if error else _result(plan, df, values)
+        for plan, error in zip(plans, errors)
+    ]
+
+def execute_plan(plan: Dict[str, Any], df: pd.DataFrame, schema: Optional[SchemaProfile] = None) -> Dict[str, Any]:
+    return execute_plans([plan], df, schema)[0]
+
+def _fmt(value: Any) -> Optional[str]:
+    """Number formatting for template answers; None for NaN."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if value != value:
+            return None
+        if value.is_integer() and abs(value) < 1e15:
+            return f"{int(value):,}"
+        return f"{value:,.2f}" if abs(value) >= 1 else f"{value:.4g}"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f"{value:,}"
+    return str(value)
+
+def phrase_result(plan: Dict[str, Any], result: Dict[str, Any]) -> Optional[str]:
+    """
+    One-sentence answer for an execute_plan result from a fixed template,
+    without the LLM. Charts come back as their image. None if the plan
+    failed or produced no usable value.
+    """
+    metrics = result.get("metrics", {})
+    if "chart" in metrics:
+        return metrics["chart"]
+    if not metrics:
+        return None
+    kind = plan.get("kind")
+    try:
+        if kind == "count_rows":
+            return f"There are {_fmt(metrics['rows'])} rows."
+        if kind in ("sum", "mean", "median"):
+            label = {"sum": "total", "mean": "average", "median": "median"}[kind]
+            value = _fmt(metrics[kind if kind != "sum" else "total"])
+            return f"The {label} {plan['col']} is {value}." if value is not None else None
+        if kind == "count_distinct":
+            return f"There are {_fmt(metrics['distinct'])} distinct {plan['col']} values."
+        if kind == "correlation":
+            corr = metrics["correlation"]
+            if corr != corr:
+                return None
+            return f"The correlation between {plan['col_x']} and {plan['col_y']} is {corr:.3f}."
+        if kind == "group_sum_top":
+            return (f"{metrics['top']} has the highest total {plan['sum_col']} "
+                    f"({_fmt(metrics['value'])}).")
+        if kind == "top_k":
+            agg = "total" if _param(plan, "agg") == "sum" else "average"
+            asc = _param(plan, "order") == "asc"
+            top = metrics["top"]
+            if len(top) == 1:
+                label, value = top[0]
+                return f"{label} has the {'lowest' if asc else 'highest'} {agg} {plan['sum_col']} ({_fmt(value)})."
+            listed = ", ".join(f"{label} ({_fmt(value)})" for label, value in top)
+            return f"{'Bottom' if asc else 'Top'} {len(top)} {plan['group_col']} values by {agg} {plan['sum_col']}: {listed}."
+        if kind == "filtered_agg":
+            agg = _param(plan, "agg")
+            value = _fmt(metrics[agg])
+            if value is None:
+                return None
+            where = f"where {plan['filter_col']} is {plan['value']}"
+            if agg == "count":
+                return f"There are {value} rows {where}."
+            label = {"sum": "total", "mean": "average", "median": "median"}[agg]
+            return f"The {label} {plan['col']} {where} is {value}."
+    except (KeyError, TypeError, ValueError):
+        return None
+    return None
@@ -0,0 +1,148 @@
+# app/dataset_cache.py
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional
+
+import pandas as pd
+
+# --- Cache settings (overridable via env) ---
+DATASET_CACHE = os.getenv("DATASET_CACHE", "1") not in ("0", "false", "no")
+DATASET_CACHE_DIR = os.getenv(
+    "DATASET_CACHE_DIR",
+    str(Path(os.getenv("STORAGE_DIR", ".cache")) / "datasets"),
+)
+DATASET_CACHE_MEMORY_MB = float(os.getenv("DATASET_CACHE_MEMORY_MB", "512"))
+DATASET_CACHE_DISK_MB = float(os.getenv("DATASET_CACHE_DISK_MB", "2048"))
+
+_BLOCK = 1 << 20
+
+
+def fingerprint(fileobj: BinaryIO) -> str:
+    """SHA-256 of a binary file object's content; rewinds it afterwards."""
+    fileobj.seek(0)
+    h = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(_BLOCK), b""):
+        h.update(block)
+    fileobj.seek(0)
+    return h.hexdigest()
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    df = entry.get("df")
+    return int(df.memory_usage(deep=True).sum()) if isinstance(df, pd.DataFrame) else 0
+
+
+class DatasetCache:
+    """
+    Parsed uploads keyed by content hash. Each entry is a dict holding the
+    DataFrame ("df", may be None) and its profile.DatasetProfile
+    ("profile"). Entries live in a memory LRU bounded by bytes and are
+    pickled to `disk_dir`, which is trimmed oldest-first to its own budget.
+    Cached frames are shared between requests: treat them as read-only.
+    """
+
+    def __init__(
+        self,
+        disk_dir: Optional[str] = DATASET_CACHE_DIR,
+        max_memory_mb: float = DATASET_CACHE_MEMORY_MB,
+        max_disk_mb: float = DATASET_CACHE_DISK_MB,
+    ):
+        self.max_memory = int(max_memory_mb * 1024 * 1024)
+        self.max_disk = int(max_disk_mb * 1024 * 1024)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.pkl"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return self._mem[key][1]
+
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    entry = pickle.load(f)
+                os.utime(path)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                entry = None
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                    self._remember(key, entry)
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._remember(key, entry)
+        if self.disk_dir:
+            # One temp file per writer: concurrent puts of the same key must not interleave
+            path = self._path(key)
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                with open(tmp, "wb") as f:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+            finally:
+                tmp.unlink(missing_ok=True)
+            self._trim_disk()
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        size = _entry_size(entry)
+        if size > self.max_memory:
+            return
+        if key in self._mem:
+            self._mem_bytes -= self._mem.pop(key)[0]
+        self._mem[key] = (size, entry)
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_memory:
+            _, (old_size, _) = self._mem.popitem(last=False)
+            self._mem_bytes -= old_size
+
+    def _trim_disk(self) -> None:
+        files = sorted(self.disk_dir.glob("*.pkl"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for p in files:
+            if total <= self.max_disk:
+                break
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "memory_entries": len(self._mem), "memory_bytes": self._mem_bytes}
+
+
+_cache: Optional[DatasetCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_dataset_cache() -> Optional[DatasetCache]:
+    """Process-wide dataset cache, created on first use; None when DATASET_CACHE=0."""
+    global _cache
+    if not DATASET_CACHE:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DatasetCache()
+    return _cache
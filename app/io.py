@@ -1,6 +1,47 @@
+import gzip
+import io
+import os
+import warnings
+from collections import Counter
 from pathlib import Path
 import pandas as pd
-from typing import Optional
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from app.metrics import timed
+
+try:
+    import pyarrow
+except ImportError:  # optional: faster CSV engine, and the only reader of the binary formats
+    pyarrow = None
+_CSV_ENGINE = "c" if pyarrow is None else "pyarrow"
+
+# Rows per chunk when a CSV is summarized incrementally
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "100000"))
+# Stop counting categories for a column once it has this many distinct values
+_MAX_TRACKED_VALUES = 10000
+# Optimized loads: infer the schema from this many rows, and treat a text
+# column as categorical when its sample has at most this many / this share
+# of distinct values
+CSV_OPTIMIZE = os.getenv("CSV_OPTIMIZE", "1") not in ("0", "false", "no")
+CSV_SAMPLE_ROWS = int(os.getenv("CSV_SAMPLE_ROWS", "10000"))
+# Parse only the columns the questions' plans touch (planned on a CSV_SAMPLE_ROWS sample)
+DATASET_PROJECTION = os.getenv("DATASET_PROJECTION", "1") not in ("0", "false", "no")
+_CATEGORY_MAX_UNIQUE = 1000
+_CATEGORY_MAX_RATIO = 0.5
+# Share of sampled values that must parse for a text column to become numeric/datetime
+_PARSE_RATIO = 0.95
+# Values tried first; the whole sample is only parsed if most of these parse
+_PROBE_VALUES = 20
+# Leading bytes of the non-CSV dataset formats, and of compressed CSV:
+# (magic, format, compression)
+_MAGIC = (
+    (b"PAR1", "parquet", None),
+    (b"ARROW1", "feather", None),  # Feather v2 is the Arrow IPC file format
+    (b"FEA1", "feather", None),
+    (b"\xff\xff\xff\xff", "arrow_stream", None),
+    (b"\x1f\x8b", "csv", "gzip"),
+    (b"\x28\xb5\x2f\xfd", "csv", "zstd"),
+)
 
 def load_txt(path: str) -> str:
     p = Path(path)
@@ -8,10 +49,324 @@ def load_txt(path: str) -> str:
         raise FileNotFoundError(f"TXT not found: {path}")
     return p.read_text(encoding="utf-8", errors="ignore")
 
-def load_csv_optional(path: Optional[str]) -> Optional[pd.DataFrame]:
+def load_csv_optional(
+    path: Optional[str],
+    optimize: bool = CSV_OPTIMIZE,
+    columns: Optional[Sequence[Any]] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Load the dataset at `path` in any format read_dataset accepts (CSV,
+    gzip/zstd CSV, Parquet, Feather/Arrow), keeping only `columns` if given.
+    """
     if not path:
         return None
     p = Path(path)
     if not p.exists():
         raise FileNotFoundError(f"CSV not found: {path}")
-    return pd.read_csv(p)
+    return read_dataset(p, columns, optimize)
+
+class _Borrowed(io.RawIOBase):
+    """Read-only view of a caller's file object that leaves it open when closed."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._f.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._f.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+def _pyarrow():
+    if pyarrow is None:
+        raise RuntimeError("Parquet, Feather/Arrow and zstd CSV input need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def detect_format(source: Union[str, Path, BinaryIO]) -> Tuple[str, Optional[str]]:
+    """
+    (format, compression) of a dataset path or binary file object, from its
+    first bytes: "parquet", "feather" (Feather or Arrow IPC file),
+    "arrow_stream" (Arrow IPC stream) or "csv" with compression None,
+    "gzip" or "zstd". Anything unrecognized is read as plain CSV.
+    """
+    if hasattr(source, "read"):
+        source.seek(0)
+        head = source.read(8)
+        source.seek(0)
+    else:
+        with open(source, "rb") as f:
+            head = f.read(8)
+    for magic, fmt, compression in _MAGIC:
+        if head.startswith(magic):
+            return fmt, compression
+    return "csv", None
+
+def _open_csv(source: Union[str, Path, BinaryIO], compression: Optional[str]) -> Union[str, Path, BinaryIO]:
+    """`source` rewound, decompressing on the fly when needed."""
+    if hasattr(source, "seek"):
+        source.seek(0)
+    if compression == "gzip":
+        return gzip.open(source, "rb")
+    if compression == "zstd":
+        pa = _pyarrow()
+        raw = pa.PythonFile(_Borrowed(source), mode="r") if hasattr(source, "read") else pa.OSFile(str(source))
+        return pa.CompressedInputStream(raw, "zstd")
+    return source
+
+def _arrow_batches(source: Union[str, Path, BinaryIO], fmt: str, batch_rows: int) -> Iterator[Any]:
+    """Record batches of a Parquet/Feather/Arrow dataset; local Feather files are memory-mapped."""
+    pa = _pyarrow()
+    local = not hasattr(source, "read")
+    if not local:
+        source.seek(0)
+        source = pa.PythonFile(_Borrowed(source), mode="r")
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        yield from pq.ParquetFile(source).iter_batches(batch_size=batch_rows)
+    elif fmt == "arrow_stream":
+        yield from pa.ipc.open_stream(source)
+    else:
+        try:
+            reader = pa.ipc.open_file(pa.memory_map(str(source)) if local else source)
+        except pa.ArrowInvalid:
+            # Feather v1 predates the IPC file layout
+            import pyarrow.feather as feather
+            yield from feather.read_table(source).to_batches(batch_rows)
+            return
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+def _arrow_table(source: Union[str, Path, BinaryIO], fmt: str, columns: Optional[Sequence[Any]]) -> Any:
+    """A Parquet/Feather/Arrow dataset as an Arrow table, reading only `columns` when given."""
+    pa = _pyarrow()
+    columns = [str(c) for c in columns] if columns is not None else None
+    local = not hasattr(source, "read")
+    if not local:
+        source.seek(0)
+        source = pa.PythonFile(_Borrowed(source), mode="r")
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(source, columns=columns)
+    if fmt == "arrow_stream":
+        table = pa.ipc.open_stream(source).read_all()
+        return table.select(columns) if columns is not None else table
+    import pyarrow.feather as feather
+    # Memory-mapped: only the selected columns' buffers are ever paged in
+    return feather.read_table(str(source) if local else source, columns=columns, memory_map=local)
+
+def _apply_schema(df: pd.DataFrame, schema: Dict[str, List[str]]) -> pd.DataFrame:
+    """Convert `df` in place per infer_csv_schema, and downcast its integers."""
+    for col in schema["category"]:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    for col in schema["numeric"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    for col in schema["datetime"]:
+        if col in df.columns:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                df[col] = pd.to_datetime(df[col], errors="coerce")
+    for col in df.select_dtypes(include="integer").columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+def read_dataset(
+    source: Union[str, Path, BinaryIO],
+    columns: Optional[Sequence[Any]] = None,
+    optimize: bool = CSV_OPTIMIZE
+) -> pd.DataFrame:
+    """
+    Load a CSV (plain, gzip or zstd), Parquet, Feather or Arrow IPC dataset
+    from a path or binary file object, detected from its first bytes.
+    Only `columns` are parsed when given; columnar formats skip the others
+    entirely. With `optimize`, every format gets read_csv_optimized's
+    dtype treatment.
+    """
+    fmt, compression = detect_format(source)
+    if fmt == "csv":
+        if optimize:
+            return read_csv_optimized(source, columns=columns, compression=compression)
+        return read_csv_stream(_open_csv(source, compression), usecols=columns)
+    return read_columnar(source, fmt, columns, optimize)
+
+@timed("dataset.read")
+def read_columnar(
+    source: Union[str, Path, BinaryIO],
+    fmt: str,
+    columns: Optional[Sequence[Any]] = None,
+    optimize: bool = CSV_OPTIMIZE
+) -> pd.DataFrame:
+    """Load a Parquet ("parquet"), Feather ("feather") or Arrow IPC stream ("arrow_stream") dataset."""
+    df = _arrow_table(source, fmt, columns).to_pandas()
+    return _apply_schema(df, infer_csv_schema(df.head(CSV_SAMPLE_ROWS))) if optimize else df
+
+def read_sample(source: Union[str, Path, BinaryIO], rows: int = CSV_SAMPLE_ROWS) -> pd.DataFrame:
+    """
+    The first `rows` rows of a dataset in any read_dataset format, with
+    optimized dtypes: enough to plan which columns a full read needs.
+    """
+    fmt, compression = detect_format(source)
+    if fmt == "csv":
+        df = pd.read_csv(_open_csv(source, compression), nrows=rows)
+    else:
+        batches, have = [], 0
+        for batch in _arrow_batches(source, fmt, rows):
+            batches.append(batch)
+            have += batch.num_rows
+            if have >= rows:
+                break
+        pa = _pyarrow()
+        df = pa.Table.from_batches(batches).slice(0, rows).to_pandas() if batches else pd.DataFrame()
+    return _apply_schema(df, infer_csv_schema(df))
+
+def iter_dataset_chunks(source: Union[str, Path, BinaryIO], chunksize: int = CSV_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """A dataset in any read_dataset format as DataFrames of about `chunksize` rows."""
+    fmt, compression = detect_format(source)
+    if fmt == "csv":
+        yield from pd.read_csv(_open_csv(source, compression), chunksize=chunksize)
+        return
+    for batch in _arrow_batches(source, fmt, chunksize):
+        yield batch.to_pandas()
+
+def _parses(values: pd.Series, parse) -> bool:
+    """Whether at least _PARSE_RATIO of `values` parse, trying a short probe first."""
+    probe = values.iloc[:_PROBE_VALUES]
+    # Numbers and dates have digits; plain text is rejected without parsing
+    if probe.astype(str).str.contains(r"\d", regex=True).mean() < 0.5:
+        return False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if parse(probe, errors="coerce").notna().mean() < 0.5:
+            return False
+        return parse(values, errors="coerce").notna().mean() >= _PARSE_RATIO
+
+def infer_csv_schema(sample: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    Classify the text columns of a sample: {"numeric": [...], "datetime": [...],
+    "category": [...]}. Columns pandas already parsed as numbers are left alone.
+    """
+    schema: Dict[str, List[str]] = {"numeric": [], "datetime": [], "category": []}
+    for col in sample.columns:
+        s = sample[col]
+        if not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)):
+            continue
+        values = s.dropna()
+        if values.empty:
+            continue
+        if _parses(values, pd.to_numeric):
+            schema["numeric"].append(col)
+            continue
+        if _parses(values, pd.to_datetime):
+            schema["datetime"].append(col)
+            continue
+        n_unique = values.nunique()
+        if n_unique <= _CATEGORY_MAX_UNIQUE and n_unique <= _CATEGORY_MAX_RATIO * len(values):
+            schema["category"].append(col)
+    return schema
+
+@timed("csv.parse")
+def read_csv_optimized(
+    source: Union[str, Path, BinaryIO],
+    sample_rows: int = CSV_SAMPLE_ROWS,
+    columns: Optional[Sequence[Any]] = None,
+    compression: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Load a CSV with a schema inferred from its first `sample_rows` rows:
+    low-cardinality text becomes categorical, numeric-looking text becomes
+    numbers, date columns are parsed once here, and integers are downcast.
+    Floats stay float64 so sums and means keep full precision.
+    Uses the pyarrow engine when it is installed. `columns` limits parsing
+    to those columns; `compression` ("gzip"/"zstd") is undone on the fly.
+    """
+    usecols = list(columns) if columns is not None else None
+    schema = infer_csv_schema(pd.read_csv(_open_csv(source, compression), nrows=sample_rows, usecols=usecols))
+
+    dtype = {c: "category" for c in schema["category"]}
+    try:
+        df = pd.read_csv(_open_csv(source, compression), dtype=dtype, engine=_CSV_ENGINE, usecols=usecols)
+    except Exception:
+        # pyarrow rejects some inputs the C parser accepts (ragged rows, odd quoting)
+        df = pd.read_csv(_open_csv(source, compression), dtype=dtype, usecols=usecols)
+    return _apply_schema(df, {**schema, "category": []})
+
+@timed("csv.parse")
+def read_csv_stream(source: Union[str, BinaryIO], **kwargs) -> pd.DataFrame:
+    """
+    Parse a CSV straight from a path or binary file object (e.g. an
+    UploadFile's spooled file) without building a decoded copy first.
+    """
+    if hasattr(source, "seekable") and source.seekable():
+        source.seek(0)
+    return pd.read_csv(source, **kwargs)
+
+@timed("csv.parse")
+def summarize_csv_chunks(
+    source: Union[str, BinaryIO],
+    chunksize: int = CSV_CHUNK_ROWS,
+    top_k: int = 5
+) -> Dict[str, Any]:
+    """
+    Build a dataset summary one chunk at a time, so peak memory is bounded
+    by `chunksize` rows rather than the file size.
+    Returns {"rows", "head", "columns": {name: stats}}; numeric columns get
+    count/nulls/sum/min/max/mean, other columns count/nulls/unique/top.
+    """
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+    rows = 0
+    head = None
+    acc: Dict[str, Dict[str, Any]] = {}
+    for chunk in iter_dataset_chunks(source, chunksize):
+        if head is None:
+            head = chunk.head(5)
+        rows += len(chunk)
+        for col in chunk.columns:
+            s = chunk[col]
+            a = acc.setdefault(col, {"numeric": True, "count": 0, "nulls": 0, "sum": 0.0,
+                                     "min": None, "max": None, "values": Counter(), "dtype": str(s.dtype)})
+            a["count"] += int(s.count())
+            a["nulls"] += int(s.isna().sum())
+            if a["numeric"] and pd.api.types.is_numeric_dtype(s):
+                if s.count():
+                    a["sum"] += float(s.sum())
+                    a["min"] = s.min() if a["min"] is None else min(a["min"], s.min())
+                    a["max"] = s.max() if a["max"] is None else max(a["max"], s.max())
+            else:
+                # Mixed or text column: keep category counts instead
+                a["numeric"] = False
+                a["dtype"] = str(s.dtype)
+                if a["values"] is not None:
+                    a["values"].update(s.dropna().astype(str).value_counts().to_dict())
+                    if len(a["values"]) > _MAX_TRACKED_VALUES:
+                        a["values"] = None
+
+    columns: Dict[str, Dict[str, Any]] = {}
+    for col, a in acc.items():
+        stats: Dict[str, Any] = {"dtype": a["dtype"], "count": a["count"], "nulls": a["nulls"]}
+        if a["numeric"]:
+            stats.update({
+                "sum": a["sum"], "min": a["min"], "max": a["max"],
+                "mean": a["sum"] / a["count"] if a["count"] else None,
+            })
+        elif a["values"] is not None:
+            stats["unique"] = len(a["values"])
+            stats["top"] = dict(a["values"].most_common(top_k))
+        else:
+            stats["unique"] = f">{_MAX_TRACKED_VALUES}"
+        columns[col] = stats
+
+    return {"rows": rows, "head": head if head is not None else pd.DataFrame(), "columns": columns}
@@ -1,55 +1,515 @@
-import time
-from typing import List, Union
-from openai import OpenAI
+import asyncio
+import json
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+from app.cache import ResponseCache, cache_bypassed, get_response_cache, make_key
+from app.metrics import LLM_CACHE, LLM_REQUESTS, LLM_RETRIES, record_llm_response, span
+from app.ratelimit import (
+    LLM_EXPECTED_COMPLETION_TOKENS, LLM_MAX_RETRIES, backoff_delay, classify_error, get_rate_limiter,
+)
+
+if TYPE_CHECKING:
+    from app.schema import SchemaProfile
+
+# --- Connection pool / concurrency settings (overridable via env) ---
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+
+# Plan shapes the LLM may return (C = an exact column name), see csv_ops.PLAN_KINDS
+_PLAN_SPEC = (
+    "Allowed plans:\n"
+    '{"kind": "count_rows"}\n'
+    '{"kind": "sum", "col": C}\n'
+    '{"kind": "mean", "col": C}\n'
+    '{"kind": "median", "col": C}\n'
+    '{"kind": "count_distinct", "col": C}\n'
+    '{"kind": "correlation", "col_x": C, "col_y": C}\n'
+    '{"kind": "group_sum_top", "group_col": C, "sum_col": C}\n'
+    '{"kind": "top_k", "group_col": C, "sum_col": C, "k": N, "agg": "sum"|"mean", "order": "desc"|"asc"}\n'
+    '{"kind": "filtered_agg", "agg": "sum"|"mean"|"median"|"count", "col": C, "filter_col": C, "value": V}'
+    ' (rows where filter_col equals V; "col" is not needed for "count")\n'
+    '{"kind": "bar_chart", "x": C, "y": C}\n'
+    '{"kind": "line_chart", "x": C, "y": C}\n'
+)
+
+
+def _strip_fences(text: str) -> str:
+    """Drop a surrounding ```json ... ``` fence if the model added one."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text.split("\n", 1)[1] if "\n" in text else text
+    return text.strip()
+
+
+# --- Shared OpenAI clients ---
+# One sync client per API key for the whole process and one async client per
+# (event loop, API key), all created on first use. Each sits on a bounded
+# keep-alive pool, so consecutive requests reuse warm TLS connections.
+_sync_clients: Dict[Optional[str], OpenAI] = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Optional[str], AsyncOpenAI]]" = \
+    weakref.WeakKeyDictionary()
+_llms: Dict[Tuple[Optional[str], str, bool], "LLMClient"] = {}
+_client_lock = threading.Lock()
+
+# Event loop thread that runs async work for sync callers (CLI, report),
+# so its pooled connections outlive any single call
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=min(LLM_MAX_KEEPALIVE, LLM_MAX_CONNECTIONS),
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_openai_client(api_key: Optional[str] = None) -> OpenAI:
+    """Process-wide sync OpenAI client (per API key; None uses OPENAI_API_KEY)."""
+    with _client_lock:
+        client = _sync_clients.get(api_key)
+        if client is None:
+            # Retries are scheduled by _send (rate limiter + backoff), not the SDK
+            client = OpenAI(
+                api_key=api_key,
+                timeout=LLM_TIMEOUT,
+                max_retries=0,
+                http_client=DefaultHttpxClient(limits=_limits(), timeout=httpx.Timeout(LLM_TIMEOUT)),
+            )
+            _sync_clients[api_key] = client
+        return client
+
+
+def get_async_openai_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """AsyncOpenAI client of the running event loop, shared by every caller on it."""
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(api_key)
+        if client is None or client.is_closed():
+            client = AsyncOpenAI(
+                api_key=api_key,
+                timeout=LLM_TIMEOUT,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=_limits(), timeout=httpx.Timeout(LLM_TIMEOUT)),
+            )
+            clients[api_key] = client
+        return client
+
+
+def get_llm(model: str = "gpt-4o-mini", use_cache: bool = True, api_key: Optional[str] = None) -> "LLMClient":
+    """Shared LLMClient for a model; cheap to call, nothing is created until first use."""
+    key = (api_key, model, use_cache)
+    with _client_lock:
+        llm = _llms.get(key)
+        if llm is None:
+            llm = _llms[key] = LLMClient(api_key=api_key, model=model, use_cache=use_cache)
+        return llm
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+        return _loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine to completion from sync code on the shared background
+    loop (instead of asyncio.run), so its LLM and web connection pools stay
+    warm between calls. Must not be called from inside a running loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError("run_sync() cannot be used inside a running event loop; await instead")
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+async def aclose_llm_clients() -> None:
+    """Close the running loop's async clients (call on server shutdown)."""
+    with _client_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def shutdown_llm_clients() -> None:
+    """Close every shared client and stop the background loop."""
+    global _loop
+    with _loop_lock:
+        loop, _loop = _loop, None
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(aclose_llm_clients(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    with _client_lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
 
 class LLMClient:
-    def __init__(self, api_key: str = None, model: str = "gpt-4o-mini"):
-        self.client = OpenAI(api_key=api_key)
+    """
+    LLM helpers for the question pipeline. Instances are lightweight: HTTP
+    clients come from the shared registry above, the response cache is
+    opened on first use, and the concurrency cap (`max_concurrency`
+    in-flight calls) applies per event loop. Every request goes through the
+    process-wide rate limiter (ratelimit.py). Use get_llm() for a shared
+    instance.
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        model: str = "gpt-4o-mini",
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+    ):
         self.model = model
+        self.use_cache = use_cache
+        self.timeout = timeout if timeout is not None else LLM_TIMEOUT
+        self._api_key = api_key
+        self._max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+        # Without a key we run heuristics-only (callers check `disabled`)
+        self.disabled = not (api_key or os.getenv("OPENAI_API_KEY"))
+
+    @property
+    def client(self) -> Optional[OpenAI]:
+        return None if self.disabled else get_openai_client(self._api_key)
+
+    @property
+    def aclient(self) -> Optional[AsyncOpenAI]:
+        return None if self.disabled else get_async_openai_client(self._api_key)
+
+    @property
+    def cache(self) -> Optional[ResponseCache]:
+        return get_response_cache() if self.use_cache else None
+
+    @property
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with _client_lock:
+            sem = self._semaphores.get(loop)
+            if sem is None:
+                sem = self._semaphores[loop] = asyncio.Semaphore(self._max_concurrency)
+            return sem
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        if cache_bypassed() or self.cache is None:
+            return None
+        value = self.cache.get(key)
+        LLM_CACHE.inc(result="miss" if value is None else "hit")
+        return value
+
+    def _cache_set(self, key: str, value: str) -> None:
+        if not cache_bypassed() and self.cache is not None:
+            self.cache.set(key, value)
+
+    @staticmethod
+    def _build_prompt(questions: List[str], context: str) -> str:
+        q_text = "\n".join([f"{i+1}. {q}" for i, q in enumerate(questions)])
+        return f"Answer the following questions based on the context.\n\nContext:\n{context}\n\nQuestions:\n{q_text}\n\nReturn answers as a JSON list of strings."
+
+    @staticmethod
+    def _parse_answers(content: str, is_single: bool) -> Union[str, List[str]]:
+        # If multiple questions, expect JSON list back
+        if not is_single:
+            try:
+                return json.loads(content)
+            except json.JSONDecodeError:
+                # fallback: split by newline
+                return [line.strip("-• ") for line in content.splitlines() if line.strip()]
+        return content
+
+    def _messages(self, user_prompt: str) -> List[dict]:
+        return [
+            {"role": "system", "content": "You are a helpful teaching assistant."},
+            {"role": "user", "content": user_prompt}
+        ]
 
     def ask(self, questions: Union[str, List[str]], context: str = "") -> Union[str, List[str]]:
         """
         Ask the LLM one or multiple questions with shared context.
         - If `questions` is a string, returns a single string.
         - If `questions` is a list, returns a list of strings.
+        Blocking wrapper around the async path; from async code use `aask`.
         """
         # Ensure questions is a list
         is_single = isinstance(questions, str)
         if is_single:
             questions = [questions]
 
-        # Build the prompt
-        q_text = "\n".join([f"{i+1}. {q}" for i, q in enumerate(questions)])
-        user_prompt = f"Answer the following questions based on the context.\n\nContext:\n{context}\n\nQuestions:\n{q_text}\n\nReturn answers as a JSON list of strings."
+        user_prompt = self._build_prompt(questions, context)
 
-        # Retry logic
-        retries = 3
-        for i in range(retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "You are a helpful teaching assistant."},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.2,
-                )
-                content = response.choices[0].message.content.strip()
-
-                # If multiple questions, expect JSON list back
-                if not is_single:
-                    import json
-                    try:
-                        return json.loads(content)
-                    except json.JSONDecodeError:
-                        # fallback: split by newline
-                        return [line.strip("-• ") for line in content.splitlines() if line.strip()]
-                return content
+        try:
+            content = run_sync(self._achat(self._messages(user_prompt)))
+        except Exception as e:
+            return f"LLM error: {str(e)}"
+        return self._parse_answers(content, is_single)
 
+    async def _send(self, request: Callable[[], Awaitable[Any]], payload: Any, model: str) -> Any:
+        """
+        Send one API request through the rate limiter, retrying transient
+        failures with jittered exponential backoff (or the server's
+        retry-after). A 429 pauses the whole queue rather than letting every
+        pending call retry at once. Outcomes, tokens and retries are counted
+        in app.metrics.
+        """
+        limiter = get_rate_limiter()
+        estimate = len(json.dumps(payload, ensure_ascii=False)) // 4 + LLM_EXPECTED_COMPLETION_TOKENS
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            with span("llm.queue"):
+                await limiter.acquire(estimate)
+            try:
+                async with self._semaphore:
+                    with span("llm.request"):
+                        response = await request()
             except Exception as e:
-                if "rate_limit_exceeded" in str(e) and i < retries - 1:
-                    wait_time = (i + 1) * 5
-                    print(f"⚠️ Rate limit hit. Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
+                retryable, rate_limited, retry_after = classify_error(e)
+                if not retryable or attempt == LLM_MAX_RETRIES:
+                    LLM_REQUESTS.inc(model=model, outcome="error")
+                    raise
+                limiter.record_retry()
+                LLM_RETRIES.inc(reason="rate_limited" if rate_limited else "transient")
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                if rate_limited:
+                    limiter.pause(delay)  # the next acquire waits it out with everyone else
                 else:
-                    return f"LLM error: {str(e)}"
+                    await asyncio.sleep(delay)
+                continue
+            usage = getattr(response, "usage", None)
+            limiter.settle(estimate, getattr(usage, "total_tokens", None))
+            record_llm_response(model, usage)
+            return response
+
+    async def _achat(
+        self,
+        messages: List[dict],
+        temperature: float = 0.2,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        One chat completion, rate limited and retried by `_send`.
+        Identical calls are served from the response cache.
+        """
+        if self.disabled:
+            raise RuntimeError("OPENAI_API_KEY not set")
+        key = make_key(self.model, messages, temperature)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        aclient = self.aclient
+        response = await self._send(
+            lambda: aclient.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                timeout=timeout or self.timeout,
+            ),
+            messages,
+            self.model,
+        )
+        content = response.choices[0].message.content.strip()
+        self._cache_set(key, content)
+        return content
+
+    async def aask(
+        self,
+        questions: Union[str, List[str]],
+        context: str = "",
+        timeout: Optional[float] = None,
+    ) -> Union[str, List[str]]:
+        """
+        Async counterpart of `ask`; never blocks the event loop.
+        Concurrent calls share one connection pool and are capped by the
+        client's concurrency limit.
+        """
+        is_single = isinstance(questions, str)
+        if is_single:
+            questions = [questions]
+
+        user_prompt = self._build_prompt(questions, context)
+        try:
+            content = await self._achat(self._messages(user_prompt), timeout=timeout)
+        except Exception as e:
+            return f"LLM error: {str(e)}"
+        return self._parse_answers(content, is_single)
+
+    # --- Pipeline helpers used by core.process_inputs ---
+
+    async def classify_route(self, q: str, has_csv: bool, columns: Optional[List[str]] = None) -> str:
+        """Return "csv" if the question is about the uploaded dataset, else "web"."""
+        if not has_csv:
+            return "web"
+        prompt = (
+            "Decide whether this question should be answered from a CSV dataset "
+            "or from a web page.\n"
+            f"Dataset columns: {columns}\n"
+            f"Question: {q}\n"
+            "Reply with exactly one word: csv or web."
+        )
+        try:
+            reply = await self._achat(self._messages(prompt), temperature=0)
+        except Exception:
+            return "csv" if columns and any(c.lower() in q.lower() for c in columns) else "web"
+        return "csv" if "csv" in reply.lower() else "web"
+
+    async def map_to_csv_plan(
+        self,
+        q: str,
+        columns: List[str],
+        schema: Optional["SchemaProfile"] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Ask the LLM for an execute_plan-style dict; None if it gives nothing usable.
+        With a `schema`, columns are listed with their roles and types.
+        """
+        prompt = (
+            "Map the question to one pandas operation plan as a JSON object.\n"
+            f"{_PLAN_SPEC}"
+            f"Columns: {schema.describe() if schema else columns}\n"
+            f"Question: {q}\n"
+            "Return only the JSON object."
+        )
+        try:
+            reply = await self._achat(self._messages(prompt), temperature=0)
+            plan = json.loads(_strip_fences(reply))
+        except Exception:
+            return None
+        return plan if isinstance(plan, dict) and plan.get("kind") else None
+
+    async def phrase_csv_answer(self, q: str, summary: str, metrics: Dict[str, Any]) -> str:
+        """Turn an execute_plan result into a short answer."""
+        # Charts are returned as-is; there is nothing to phrase
+        if "chart" in metrics:
+            return metrics["chart"]
+        prompt = (
+            f"Question: {q}\n"
+            f"Computed result: {summary}\n"
+            f"Metrics: {metrics}\n"
+            "Answer the question in one short sentence using only the computed result."
+        )
+        try:
+            return await self._achat(self._messages(prompt))
+        except Exception:
+            return summary
+
+    async def answer_with_context(self, q: str, context: str) -> str:
+        return await self.aask(q, context)
+
+    # --- Batched variants: one LLM call for a whole question file ---
+
+    async def plan_questions(
+        self,
+        questions: List[str],
+        columns: Optional[List[str]] = None,
+        schema: Optional["SchemaProfile"] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Classify and plan every question in one call. Returns one
+        {"route": "csv"|"web", "plan": {...}|None} per question, or None for
+        entries the model skipped or mangled. Callers validate the plans.
+        With a `schema`, columns are listed with their roles and types.
+        """
+        if not questions:
+            return []
+        q_text = "\n".join(f"{i+1}. {q}" for i, q in enumerate(questions))
+        if schema is not None:
+            columns = schema.describe()
+        prompt = (
+            "For each question decide whether it is answered from the CSV dataset "
+            '("csv") or from a web page ("web"). For csv questions also give one '
+            "pandas operation plan.\n"
+            f"{_PLAN_SPEC}"
+            f"Dataset columns: {columns if columns else 'no dataset uploaded'}\n\n"
+            f"Questions:\n{q_text}\n\n"
+            "Return only a JSON list with one object per question, in order: "
+            '[{"route": "csv", "plan": {...}}, {"route": "web", "plan": null}, ...]'
+        )
+        try:
+            reply = await self._achat(self._messages(prompt), temperature=0)
+            items = json.loads(_strip_fences(reply))
+        except Exception:
+            return [None] * len(questions)
+        if not isinstance(items, list):
+            return [None] * len(questions)
+
+        out: List[Optional[Dict[str, Any]]] = []
+        for i in range(len(questions)):
+            item = items[i] if i < len(items) else None
+            ok = isinstance(item, dict) and item.get("route") in ("csv", "web")
+            out.append(item if ok else None)
+        return out
+
+    async def phrase_csv_answers(self, items: List[Dict[str, Any]]) -> List[str]:
+        """
+        Batched phrase_csv_answer. `items` are dicts with "question",
+        "summary" and "metrics"; answers come back in the same order.
+        """
+        answers = [it["metrics"]["chart"] if "chart" in it.get("metrics", {}) else None for it in items]
+        todo = [i for i, a in enumerate(answers) if a is None]
+        if todo:
+            lines = "\n".join(
+                f"{n+1}. Question: {items[i]['question']} | Computed result: {items[i]['summary']}"
+                for n, i in enumerate(todo)
+            )
+            prompt = (
+                "Answer each question in one short sentence using only its computed result.\n\n"
+                f"{lines}\n\n"
+                "Return answers as a JSON list of strings, in the same order."
+            )
+            try:
+                phrased = json.loads(_strip_fences(await self._achat(self._messages(prompt))))
+            except Exception:
+                phrased = None
+            if not isinstance(phrased, list) or len(phrased) != len(todo):
+                phrased = [items[i]["summary"] for i in todo]
+            for i, text in zip(todo, phrased):
+                answers[i] = str(text)
+        return answers
+
+    async def respond(self, prompt: str, model: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """
+        Send a raw prompt through the Responses API and return the output text.
+        """
+        if self.disabled:
+            raise RuntimeError("OPENAI_API_KEY not set")
+        model = model or self.model
+        key = make_key(model, prompt)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        aclient = self.aclient
+        response = await self._send(
+            lambda: aclient.responses.create(model=model, input=prompt, timeout=timeout or self.timeout),
+            prompt,
+            model,
+        )
+        text = response.output[0].content[0].text.strip()
+        self._cache_set(key, text)
+        return text
@@ -1,26 +1,44 @@
 import argparse
 import json
-from app.io import load_txt, load_csv_optional
+import sys
+from pathlib import Path
+from app.io import DATASET_PROJECTION, load_txt, load_csv_optional, read_sample
+from app.qna import extract_questions, plan_projection
 from app.core import process_inputs
+from app.ratelimit import PRIORITY_BATCH, request_priority
 
-def run(txt_path, csv_path=None):
+def run(txt_path, csv_path=None, concurrency=None, use_cache=True, per_question=False):
     text = load_txt(txt_path)
-    df = load_csv_optional(csv_path)
-    questions, answers, report_md, report_json = process_inputs(text, df)
-
-    # ✅ Extract *only* the plain answers
-    answers_only = [a.get("answer", "") for a in answers]
+    # Plan on a sample first, then parse only the columns the questions touch
+    columns = None
+    if csv_path and DATASET_PROJECTION and Path(csv_path).exists():
+        columns = plan_projection(extract_questions(text) or [text], read_sample(csv_path))
+    df = load_csv_optional(csv_path, columns=columns)
+    # CLI runs queue behind interactive API calls sharing the LLM quota
+    with request_priority(PRIORITY_BATCH):
+        questions, answers = process_inputs(text, df, max_concurrency=concurrency,
+                                            batched=not per_question, use_cache=use_cache)
 
     # Print only the JSON array
-    print(json.dumps(answers_only, ensure_ascii=False, indent=2))
+    print(json.dumps(answers, ensure_ascii=False, indent=2))
 
     # Persist the same JSON array
     with open("report.json", "w", encoding="utf-8") as f:
-        json.dump(answers_only, f, ensure_ascii=False, indent=2)
+        json.dump(answers, f, ensure_ascii=False, indent=2)
 
 if __name__ == "__main__":
+    # `python -m app.main batch ...` runs many jobs from a manifest (see app.batch)
+    if sys.argv[1:2] == ["batch"]:
+        from app.batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--txt", required=True)
-    parser.add_argument("--csv")
+    parser.add_argument("--csv", help="dataset: CSV (optionally .gz/.zst), Parquet, Feather or Arrow IPC")
+    parser.add_argument("--per-question", action="store_true",
+                        help="one set of LLM calls per question instead of a few batched calls")
+    parser.add_argument("--concurrency", type=int,
+                        help="with --per-question, questions answered in parallel (default CORE_FANOUT)")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the LLM response cache")
     args = parser.parse_args()
-    run(args.txt, args.csv)
+    run(args.txt, args.csv, args.concurrency, use_cache=not args.no_cache, per_question=args.per_question)
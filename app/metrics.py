@@ -0,0 +1,417 @@
+# app/metrics.py
+"""
+In-process instrumentation with no external dependencies.
+
+- span(stage) / timed(stage): wall-clock timing of pipeline stages, kept
+  in a per-stage histogram and in the current request's trace.
+- LLM request, token and retry counters (fed by llm._send).
+- Peak resident memory while each request runs, sampled in a background
+  thread.
+- render(): everything above in the Prometheus text format, for GET /metrics.
+- SamplingProfiler: periodic Python stack samples of every thread,
+  written as collapsed stacks (flamegraph.pl / speedscope input).
+"""
+import contextvars
+import functools
+import inspect
+import os
+import resource
+import sys
+import threading
+import time
+import weakref
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# --- Instrumentation settings (overridable via env) ---
+# Send a Server-Timing header on every response (otherwise only with ?timing=true)
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "0") == "1"
+# Honour ?profile=true (off by default: profiling slows the whole process)
+METRICS_PROFILING = os.getenv("METRICS_PROFILING", "0") == "1"
+METRICS_PROFILE_INTERVAL = float(os.getenv("METRICS_PROFILE_INTERVAL", "0.005"))  # seconds between samples
+METRICS_PROFILE_DIR = os.getenv(
+    "METRICS_PROFILE_DIR",
+    str(Path(os.getenv("STORAGE_DIR", ".cache")) / "profiles"),
+)
+METRICS_MEMORY_INTERVAL = float(os.getenv("METRICS_MEMORY_INTERVAL", "0.05"))  # seconds between RSS samples
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MEMORY_BUCKETS = tuple(float(2 ** n * 2 ** 20) for n in range(5, 15))  # 32 MB .. 16 GB
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_number(value)}" for name, labels, value in self.samples()]
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _labels_text(self.labels, key), value
+
+
+class Gauge(_Metric):
+    """Set explicitly, or read from `source` (returning {label values: value}) at render time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 source: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, help, labels)
+        self._source = source
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self._source is not None:
+            items = sorted(self._source().items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _labels_text(self.labels, key), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket", _labels_text(self.labels, key, f'le="{_number(bound)}"'), cumulative
+            yield f"{self.name}_sum", _labels_text(self.labels, key), total
+            yield f"{self.name}_count", _labels_text(self.labels, key), count
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# --- Memory ---
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Highest resident set size of this process so far, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+# --- Metrics ---
+
+STAGE_SECONDS = Histogram("app_stage_seconds", "Wall-clock time spent in a pipeline stage.", ["stage"])
+HTTP_REQUESTS = Counter("app_http_requests_total", "HTTP requests served.", ["method", "route", "status"])
+HTTP_SECONDS = Histogram("app_http_request_seconds", "HTTP request time, including streamed bodies.", ["route"])
+REQUEST_PEAK_RSS = Histogram(
+    "app_request_peak_rss_bytes", "Peak process RSS sampled while a request ran.", ["route"], MEMORY_BUCKETS,
+)
+LLM_REQUESTS = Counter("app_llm_requests_total", "LLM API requests by outcome.", ["model", "outcome"])
+LLM_TOKENS = Counter("app_llm_tokens_total", "LLM tokens reported by the API.", ["model", "type"])
+LLM_RETRIES = Counter("app_llm_retries_total", "LLM requests retried.", ["reason"])
+LLM_CACHE = Counter("app_llm_cache_total", "LLM response cache lookups.", ["result"])
+Gauge("app_process_resident_memory_bytes", "Current resident set size.", source=lambda: {(): current_rss()})
+Gauge("app_process_peak_resident_memory_bytes", "Peak resident set size.", source=lambda: {(): peak_rss()})
+
+
+def record_llm_response(model: str, usage: Any) -> None:
+    """Count one successful LLM request and the tokens its `usage` reports (chat or responses API)."""
+    LLM_REQUESTS.inc(model=model, outcome="ok")
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if prompt is None:
+        prompt = getattr(usage, "input_tokens", None)
+        completion = getattr(usage, "output_tokens", None)
+    if prompt:
+        LLM_TOKENS.inc(prompt, model=model, type="prompt")
+    if completion:
+        LLM_TOKENS.inc(completion, model=model, type="completion")
+
+
+# --- Per-request traces ---
+
+class RequestTrace:
+    """Stage timings and peak RSS of one request (spans in threads and tasks it starts included)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}  # stage -> [seconds, calls]
+        self.peak_rss = current_rss()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing header value. Concurrent calls of a stage add up, so a stage may exceed `total`."""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda kv: -kv[1][0])
+        parts = [f'{name};dur={s * 1000:.1f};desc="{int(n)}x"' for name, (s, n) in stages]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        parts.append(f'rss;desc="peak {self.peak_rss / 2 ** 20:.0f}MB"')
+        return ", ".join(parts)
+
+
+_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _trace.get()
+
+
+class _MemoryWatcher:
+    """Samples RSS every METRICS_MEMORY_INTERVAL while any request is being traced."""
+
+    def __init__(self):
+        self._active: "weakref.WeakSet[RequestTrace]" = weakref.WeakSet()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self, trace: RequestTrace) -> None:
+        with self._lock:
+            self._active.add(trace)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-rss", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def untrack(self, trace: RequestTrace) -> None:
+        trace.peak_rss = max(trace.peak_rss, current_rss())
+        with self._lock:
+            self._active.discard(trace)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._wake.clear()
+            if not active:
+                self._wake.wait()
+                continue
+            rss = current_rss()
+            for trace in active:
+                if rss > trace.peak_rss:
+                    trace.peak_rss = rss
+            time.sleep(METRICS_MEMORY_INTERVAL)
+
+
+_memory = _MemoryWatcher()
+
+
+def start_request() -> RequestTrace:
+    """
+    Begin tracing the current request. Spans in this context, and in the
+    tasks and threads it starts, join the trace; servers run each request
+    in its own task, so the trace ends with it.
+    """
+    trace = RequestTrace()
+    _memory.track(trace)
+    _trace.set(trace)
+    return trace
+
+
+def finish_request(trace: RequestTrace, method: str, route: str, status: int) -> None:
+    _memory.untrack(trace)
+    HTTP_REQUESTS.inc(method=method, route=route, status=status)
+    HTTP_SECONDS.observe(trace.elapsed(), route=route)
+    REQUEST_PEAK_RSS.observe(trace.peak_rss, route=route)
+
+
+# --- Spans ---
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as `stage` (works in sync and async code)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(stage, elapsed)
+
+
+def timed(stage: str):
+    """Decorator form of span() for plain and async functions."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- Sampling profiler ---
+
+# Leaf frames of threads that are parked rather than working
+_IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"), ("queue.py", "get"), ("thread.py", "_worker"),
+    ("metrics.py", "_run"),  # the RSS sampler between samples
+}
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of every other thread every `interval`
+    seconds until stopped. Samples cover the whole process, so other
+    requests running at the same time show up too; idle (waiting)
+    threads are left out.
+    """
+
+    def __init__(self, interval: float = METRICS_PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: _Tally = _Tally()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="metrics-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """One "frame;frame;... count" line per distinct stack, most sampled first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def default_path(self, directory: str = METRICS_PROFILE_DIR, label: str = "request") -> str:
+        name = f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(self):x}.txt"
+        return str(Path(directory) / name)
+
+    def save(self, path: Optional[str] = None) -> str:
+        """Write collapsed stacks to `path` (default_path() if None); returns the path."""
+        out = Path(path or self.default_path())
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(self.collapsed(), encoding="utf-8")
+        return str(out)
@@ -0,0 +1,151 @@
+# app/profile.py
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from app.qna import ColumnIndex, mentioned_columns
+from app.retrieval import estimate_tokens
+from app.schema import SchemaProfile, schema_profile
+
+# --- Prompt summary settings (overridable via env) ---
+PROFILE_TOKEN_BUDGET = int(os.getenv("PROFILE_TOKEN_BUDGET", "800"))
+PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "5"))
+_SAMPLE_ROWS = 3
+
+
+def _fmt(v: Any) -> str:
+    if isinstance(v, float):
+        return f"{v:.6g}"
+    return str(v)
+
+
+class DatasetProfile:
+    """
+    Per-column statistics of a dataset, computed once and rendered into a
+    compact, question-aware prompt summary within a token budget. Types,
+    null counts and column roles come from the dataset's SchemaProfile.
+    Numeric sketches (min/max/mean/median) are computed for all numeric
+    columns in one vectorized call; top categories are counted lazily,
+    only for columns that end up in a summary.
+    """
+
+    def __init__(self, df: Optional[pd.DataFrame] = None, top_k: int = PROFILE_TOP_K):
+        self.top_k = top_k
+        self.rows = 0
+        self.columns: List[Any] = []
+        self.dtypes: Dict[Any, str] = {}
+        self.stats: Dict[Any, Dict[str, Any]] = {}
+        self.sample: Optional[pd.DataFrame] = None
+        self.schema = SchemaProfile()
+        self._df = df
+        self._index: Optional[ColumnIndex] = None
+        if df is None:
+            return
+
+        self.schema = schema_profile(df)
+        self.rows = len(df)
+        self.columns = list(df.columns)
+        self.dtypes = dict(self.schema.dtypes)
+        self.sample = df.head(_SAMPLE_ROWS)
+        for c in self.columns:
+            self.stats[c] = {"nulls": self.schema.nulls[c]}
+        num = self.schema.measures
+        if num:
+            sketch = df[num].agg(["min", "max", "mean", "median"])
+            for c in num:
+                self.stats[c].update(sketch[c].to_dict())
+
+    @classmethod
+    def from_chunk_summary(cls, summary: Dict[str, Any], top_k: int = PROFILE_TOP_K) -> "DatasetProfile":
+        """Profile from io.summarize_csv_chunks output (no DataFrame kept)."""
+        prof = cls(top_k=top_k)
+        prof.schema = SchemaProfile.from_chunk_summary(summary)
+        prof.rows = summary["rows"]
+        prof.columns = list(summary["columns"])
+        prof.sample = summary["head"].head(_SAMPLE_ROWS)
+        for c, s in summary["columns"].items():
+            prof.dtypes[c] = s["dtype"]
+            stats = {"nulls": s["nulls"]}
+            for key in ("min", "max", "mean"):
+                if key in s:
+                    stats[key] = s[key]
+            if "top" in s:
+                stats["top"] = list(s["top"].items())[:top_k]
+                stats["unique"] = s["unique"]
+            prof.stats[c] = stats
+        return prof
+
+    def __getstate__(self):
+        # The frame is cached next to the profile already; don't pickle it twice
+        state = dict(self.__dict__)
+        state["_df"] = None
+        state["_index"] = None
+        return state
+
+    def attach(self, df: Optional[pd.DataFrame]) -> "DatasetProfile":
+        """Re-link the frame after unpickling, for lazy top-k counts."""
+        self._df = df
+        return self
+
+    def _top(self, col: Any) -> None:
+        s = self.stats[col]
+        if "top" in s or "mean" in s or self._df is None:
+            return
+        counts = self._df[col].value_counts(dropna=True)
+        s["unique"] = int(len(counts))
+        s["top"] = [(k, int(v)) for k, v in counts.head(self.top_k).items()]
+
+    def describe_column(self, col: Any) -> str:
+        self._top(col)
+        s = self.stats[col]
+        role = self.schema.roles.get(col, "?")
+        parts = [f"{col} ({self.dtypes.get(col, '?')}, {role}, {s['nulls']} nulls)"]
+        sketch = [f"{k}={_fmt(s[k])}" for k in ("min", "max", "mean", "median") if k in s]
+        if sketch:
+            parts.append(" ".join(sketch))
+        if "top" in s:
+            top = ", ".join(f"{_fmt(k)}: {v}" for k, v in s["top"])
+            parts.append(f"{s.get('unique', '?')} unique; top: {top}")
+        return " | ".join(parts)
+
+    def summary(self, questions: Sequence[str] = (), token_budget: int = PROFILE_TOKEN_BUDGET) -> str:
+        """
+        Compact dataset summary for an LLM prompt: shape, column names, then
+        detailed stats for the columns the questions mention (all columns,
+        in order, if none are mentioned) and a few sample rows, stopping
+        before `token_budget` is exceeded.
+        """
+        lines = [f"Rows: {self.rows}; columns: {len(self.columns)}"]
+        budget = token_budget - estimate_tokens(lines[0])
+
+        names = ", ".join(str(c) for c in self.columns)
+        if estimate_tokens(names) > budget // 3:
+            names = names[: (budget // 3) * 4].rsplit(", ", 1)[0] + ", ..."
+        lines.append(f"Column names: {names}")
+        budget -= estimate_tokens(lines[-1])
+
+        if self._index is None:
+            self._index = ColumnIndex(self.columns)
+        relevant: List[Any] = []
+        for q in questions:
+            relevant += [c for c in mentioned_columns(q, self._index) if c not in relevant]
+        detail = relevant or self.columns
+
+        lines.append("Column stats:")
+        shown = []
+        for col in detail:
+            line = f"- {self.describe_column(col)}"
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            lines.append(line)
+            shown.append(col)
+            budget -= cost
+
+        if shown and self.sample is not None:
+            sample = self.sample[[c for c in shown if c in self.sample.columns]].to_string(index=False)
+            if estimate_tokens(sample) <= budget:
+                lines.append("Sample rows:")
+                lines.append(sample)
+        return "\n".join(lines)
@@ -1,90 +1,456 @@
+import codecs
 import re
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from collections import Counter
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence, TextIO, BinaryIO, Tuple, Union
 from difflib import get_close_matches
 
-QUESTION_RE = re.compile(r"([^?.!]*\?)(?:\s|$)", re.MULTILINE)
+from app.csv_ops import plan_columns
+from app.schema import SchemaProfile, for_frame, schema_profile
 
-def extract_questions(text: str) -> List[str]:
+# A question ends at "?"; "Q1:" / "Q2." / "Q)" style markers start a new one
+QUESTION_BOUNDARY_RE = re.compile(r"\?|\bQ\d*[:.)]")
+# At least three words in an already stripped fragment
+_MIN_WORDS_RE = re.compile(r"\s\S+\s")
+_READ_CHARS = 1 << 20
+
+def _text_chunks(source: Union[str, TextIO, BinaryIO, Iterable[str]]) -> Iterator[str]:
+    if isinstance(source, str):
+        yield source
+        return
+    read = getattr(source, "read", None)
+    if read is None:
+        yield from source
+        return
+    decoder = None
+    while True:
+        chunk = read(_READ_CHARS)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            decoder = decoder or codecs.getincrementaldecoder("utf-8")(errors="ignore")
+            chunk = decoder.decode(chunk)
+        yield chunk
+
+def iter_questions(source: Union[str, TextIO, BinaryIO, Iterable[str]]) -> Iterator[Tuple[int, str]]:
+    """
+    Stream questions out of free-form text as (offset, question) pairs,
+    where offset is the character position of the question in the input.
+    `source` is a string, a text or binary (UTF-8) file object read in
+    1M-character blocks, or any iterable of text chunks (e.g. file lines).
+    A question is the text since the previous "?" or Q-marker, ending in
+    "?" and at least three words long; repeats (ignoring case) are skipped.
+    Only the text after the last boundary is held between chunks.
+    """
+    seen = set()
+    buf = ""
+    base = 0  # input offset of buf[0]
+    for chunk in _text_chunks(source):
+        buf = buf + chunk if buf else chunk
+        start = 0
+        for m in QUESTION_BOUNDARY_RE.finditer(buf):
+            end = m.end()
+            # Fragments cut off by a Q-marker never end in "?"
+            if m.group() == "?":
+                part = buf[start:end]
+                q = part.strip()
+                if _MIN_WORDS_RE.search(q):
+                    low = q.lower()
+                    if low not in seen:
+                        seen.add(low)
+                        yield base + start + len(part) - len(part.lstrip()), q
+            start = end
+        buf = buf[start:]
+        base += start
+
+def extract_questions(text: Union[str, TextIO, BinaryIO, Iterable[str]]) -> List[str]:
     """
     Extract questions from free-form text.
     Captures '?' endings and Q: style.
     """
-    # Split by question marks and Q markers
-    parts = re.split(r'(?<=\?)|\bQ\d*[:.)]', text)
-    qs = []
-    for p in parts:
-        p = p.strip()
-        if len(p.split()) >= 3 and p.endswith("?"):
-            qs.append(p)
+    return [q for _, q in iter_questions(text)]
+
+def instruction_text(text: str) -> str:
+    """
+    The part of `text` that is not an extracted question (output format,
+    chart requests, ...), with Q-markers and list numbering dropped.
+    Empty when the questions make up the whole file.
+    """
+    parts, pos = [], 0
+    for offset, q in iter_questions(text):
+        parts.append(text[pos:offset])
+        pos = offset + len(q)
+    parts.append(text[pos:])
+    rest = QUESTION_BOUNDARY_RE.sub(" ", "".join(parts))
+    return rest.strip() if re.search(r"[^\W\d_]", rest) else ""
+
+_FUZZY_CANDIDATES = 16
+_WORD_RE = re.compile(r"[a-z0-9_]{3,}")
+_CSV_CUES = (
+    "in the dataset", "in the csv", "average", "count", "top",
+    "group", "mean", "sum", "unique", "by ", "total", "median",
+    "correlation", "chart", "plot", "graph", "trend",
+)
+
+
+def _grams(s: str) -> set:
+    s = f" {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class ColumnIndex:
+    """
+    Lookup structures over a fixed list of column names, built once and
+    reused for every question: a lowercase name map, a 3-gram inverted
+    index that narrows fuzzy matching to a few candidates, each name keyed
+    by its rarest 3-gram for finding names inside a question. Fuzzy
+    results are memoized. Column types live in schema.SchemaProfile.
+    """
 
-    # Deduplicate while preserving order
-    seen, out = set(), []
-    for q in qs:
-        low = q.lower()
-        if low not in seen:
-            seen.add(low)
-            out.append(q)
-    return out
+    def __init__(self, columns: Sequence[Any]):
+        self.columns = list(columns)
+        self.position = {c: i for i, c in reversed(list(enumerate(self.columns)))}
+        self.lower: Dict[str, Any] = {}
+        for c in self.columns:
+            self.lower.setdefault(str(c).lower(), c)
 
+        self._grams: Dict[str, List[str]] = {}
+        for low in self.lower:
+            for g in _grams(low):
+                self._grams.setdefault(g, []).append(low)
+        # A name can only occur in a text containing its rarest 3-gram
+        self._anchor: Dict[str, List[str]] = {}
+        for low in self.lower:
+            inner = [low[i:i + 3] for i in range(len(low) - 2)]
+            anchor = min(inner, key=lambda g: len(self._grams[g])) if inner else low
+            self._anchor.setdefault(anchor, []).append(low)
+        self._fuzzy: Dict[Tuple[str, float], Optional[Any]] = {}
 
-def classify_question(q: str, has_csv: bool, columns: Optional[List[str]] = None) -> str:
+    def match(self, text: str, cutoff: float = 0.6) -> Optional[Any]:
+        """Exact (case-insensitive) or closest fuzzy column for a text fragment."""
+        low = text.lower()
+        if low in self.lower:
+            return self.lower[low]
+        key = (low, cutoff)
+        if key in self._fuzzy:
+            return self._fuzzy[key]
+        shared = Counter(name for g in _grams(low) for name in self._grams.get(g, ()))
+        candidates = [name for name, _ in shared.most_common(_FUZZY_CANDIDATES)]
+        matches = get_close_matches(low, candidates, n=1, cutoff=cutoff)
+        found = self.lower[matches[0]] if matches else None
+        self._fuzzy[key] = found
+        return found
+
+    def in_text(self, text: str) -> List[Any]:
+        """Columns whose (lowercased) name occurs in `text`, in column order."""
+        tl = text.lower()
+        subs = {tl[i:i + n] for n in (1, 2, 3) for i in range(len(tl) - n + 1)}
+        hits = {self.lower[low] for s in subs for low in self._anchor.get(s, ()) if low in tl}
+        return sorted(hits, key=self.position.__getitem__)
+
+
+def _build_index(df: pd.DataFrame) -> ColumnIndex:
+    return ColumnIndex(df.columns)
+
+
+def column_index(df: pd.DataFrame) -> ColumnIndex:
+    """ColumnIndex of a DataFrame, cached while the frame and its columns are unchanged."""
+    return for_frame(df, _build_index)
+
+
+def _as_index(columns: Union[ColumnIndex, Sequence[Any], None]) -> ColumnIndex:
+    return columns if isinstance(columns, ColumnIndex) else ColumnIndex(columns or [])
+
+
+def classify_question(q: str, has_csv: bool, columns: Union[ColumnIndex, List[str], None] = None) -> str:
     """
     Hybrid classifier: checks CSV columns, keywords, then defaults to web.
     """
     ql = q.lower()
     if has_csv and columns:
         # Column name match
-        for col in columns:
-            if col.lower() in ql:
-                return "csv"
-
-    cues = [
-        "in the dataset", "in the csv", "average", "count", "top",
-        "group", "mean", "sum", "unique", "by ", "total", "median",
-        "correlation", "chart", "plot", "graph", "trend"
-    ]
-    if has_csv and any(c in ql for c in cues):
+        if _as_index(columns).in_text(ql):
+            return "csv"
+
+    if has_csv and any(c in ql for c in _CSV_CUES):
         return "csv"
 
     return "web"
 
 
-def _match_column(text: str, columns: List[str]) -> Optional[str]:
+def _match_column(text: str, columns: Union[ColumnIndex, List[str]]) -> Optional[str]:
     """Fuzzy match text fragment against dataframe columns."""
-    matches = get_close_matches(text.lower(), [c.lower() for c in columns], n=1, cutoff=0.6)
-    if matches:
-        for c in columns:
-            if c.lower() == matches[0]:
-                return c
+    return _as_index(columns).match(text)
+
+
+def mentioned_columns(q: str, columns: Union[ColumnIndex, List[str]]) -> List[str]:
+    """
+    Columns a question refers to: exact (case-insensitive) name matches,
+    then fuzzy matches of the question's words. Order follows `columns`.
+    """
+    index = _as_index(columns)
+    ql = q.lower()
+    hits = set(index.in_text(ql))
+    for w in _WORD_RE.findall(ql):
+        m = index.match(w, cutoff=0.8)
+        if m is not None:
+            hits.add(m)
+    return sorted(hits, key=index.position.__getitem__)
+
+
+# Dimension columns with more distinct values than this are not searched for filter values
+_FILTER_MAX_VALUES = 1000
+_VALUE_WORDS_RE = re.compile(r"[a-z0-9_]+")
+_NUMBER_WORDS = {"two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+_TOP_K_RE = re.compile(
+    r"\b(?:which|what|list|show|the|top|bottom|first|best|worst|highest|lowest|largest|smallest|biggest)"
+    r"\s+(\d{1,2}|"
+    + "|".join(_NUMBER_WORDS) + r")\b"
+)
+_TOP_RE = re.compile(r"\b(?:top|highest|largest|biggest|best|most)\b")
+_BOTTOM_RE = re.compile(r"\b(?:bottom|lowest|smallest|least|worst)\b")
+_DISTINCT_RE = re.compile(r"\b(?:distinct|unique|different)\b")
+_COUNT_ROWS_RE = re.compile(r"\b(?:how many|number of|count of|count the)\b")
+_ROW_WORDS_RE = re.compile(r"\b(?:rows?|records?|entries|lines)\b")
+_AGG_RES = (
+    ("mean", re.compile(r"\b(?:average|mean|avg)\b")),
+    ("median", re.compile(r"\bmedian\b")),
+    ("sum", re.compile(r"\b(?:total|sum)\b")),
+)
+# "1. ", "Q2) ", "- " list markers in front of a question
+_ENUM_PREFIX_RE = re.compile(r"^\s*(?:q?\d+\s*[.):]|[-*])\s*")
+# Qualifiers a plan cannot express: negation, ratios/percentages/taxes,
+# dates and periods, comparisons. Questions using them go to the LLM.
+_QUALIFIER_RE = re.compile(
+    r"%|\b(?:not|no|excluding|excludes?|excluded|except|without|other than|besides|"
+    r"percent|percentage|pct|ratio|proportion|share|fraction|rate|tax|taxes|vat|margin|"
+    r"growth|change|increase|decrease|compared?|vs|versus|"
+    r"above|below|under|greater|less|fewer|more than|than|exceeds?|exceeding|at least|at most|"
+    r"jan|january|feb|february|mar|march|apr|april|may|june?|july?|aug|august|sept?|september|"
+    r"oct|october|nov|november|dec|december|years?|yearly|annual|annually|quarters?|quarterly|q[1-4]|"
+    r"months?|monthly|weeks?|weekly|days?|daily|today|yesterday|ytd|since|before|after|during|until|"
+    r"last|previous|next)\b"
+)
+# Words a confident plan may leave unexplained: question phrasing and the
+# intents parsed below. Any other word not part of a named column or the
+# filter value means the question says something the plan would ignore.
+_PLAN_WORDS = frozenset("""
+    a an the of in on for by to from with and across all each overall its their it this that there
+    what which who whose how many much is are was were be do does did has have had can could would
+    you please me us tell give show list find compute calculate get return
+    plot draw make create chart graph bar line over time
+    dataset data table file csv row rows record records entry entries lines value values
+    number count total sum average mean avg median
+    top bottom first highest lowest largest smallest biggest best worst most least
+    distinct unique different correlation correlated between
+""".split())
+_AMBIGUOUS = object()
+
+
+def _build_value_index(df: pd.DataFrame) -> Tuple[Dict[str, Tuple[Any, Any]], int]:
+    schema = schema_profile(df)
+    values: Dict[str, Tuple[Any, Any]] = {}
+    longest = 1
+    for col in schema.dimensions:
+        if schema.kinds[col] == "bool" or schema.cardinality[col] > _FILTER_MAX_VALUES:
+            continue
+        s = df[col]
+        distinct = s.cat.categories if isinstance(s.dtype, pd.CategoricalDtype) else s.dropna().unique()
+        for v in distinct:
+            words = _VALUE_WORDS_RE.findall(str(v).lower())
+            if not words or len(" ".join(words)) < 2:
+                continue
+            key = " ".join(words)
+            # A value shared by two columns cannot say which one to filter
+            prev = values.get(key)
+            if prev is None:
+                values[key] = (col, v)
+            elif prev is not _AMBIGUOUS and prev[0] != col:
+                values[key] = _AMBIGUOUS
+            longest = max(longest, len(words))
+    return values, longest
+
+
+def dimension_values(df: pd.DataFrame) -> Tuple[Dict[str, Tuple[Any, Any]], int]:
+    """
+    Lowercased values of the low-cardinality dimension columns, as
+    {"word word": (column, value)}, plus the longest value in words.
+    Built once per frame.
+    """
+    return for_frame(df, _build_value_index)
+
+
+def _filter_value(ql: str, df: pd.DataFrame, columns: Sequence[Any]) -> Any:
+    """(column, value) of the one dimension value named in `ql`, None, or _AMBIGUOUS."""
+    values, longest = dimension_values(df)
+    if not values:
+        return None
+    names = {str(c).lower() for c in columns}
+    words = _VALUE_WORDS_RE.findall(ql)
+    found = set()
+    i = 0
+    while i < len(words):
+        for n in range(min(longest, len(words) - i), 0, -1):
+            key = " ".join(words[i:i + n])
+            hit = values.get(key)
+            if hit is not None and key not in names:
+                if hit is _AMBIGUOUS:
+                    return _AMBIGUOUS
+                found.add(hit)
+                i += n - 1
+                break
+        i += 1
+    if len(found) > 1:
+        return _AMBIGUOUS
+    return found.pop() if found else None
+
+
+def _unexplained_words(
+    ql: str,
+    index: ColumnIndex,
+    cols: Sequence[Any],
+    filter_value: Any,
+    k_match: Optional[re.Match]
+) -> List[str]:
+    """Words of `ql` that are neither phrasing/intent, a named column, the filter value nor the k of a top-k."""
+    known = set(_PLAN_WORDS)
+    for c in cols:
+        known.update(_VALUE_WORDS_RE.findall(str(c).lower()))
+    if filter_value is not None:
+        known.update(_VALUE_WORDS_RE.findall(str(filter_value).lower()))
+    if k_match is not None:
+        known.add(k_match.group(1))
+    return [w for w in _VALUE_WORDS_RE.findall(ql)
+            if w not in known and index.match(w, cutoff=0.8) not in cols]
+
+
+def confident_plan(
+    q: str,
+    df: pd.DataFrame,
+    index: Optional[ColumnIndex] = None,
+    schema: Optional[SchemaProfile] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    A plan for `q` only when the question says unambiguously what to
+    compute: one recognized intent, and every column it needs named in the
+    question (a dimension value such as "North" names its column as a
+    filter). Every word must be accounted for by the phrasing, the intent,
+    a named column or the filter value; qualifiers a plan cannot express
+    (negation, percentages, periods, comparisons) rule it out. Returns None
+    whenever plan_csv_op would have to guess, so the caller can fall back
+    to the LLM.
+    """
+    ql = _ENUM_PREFIX_RE.sub("", q.lower())
+    if _QUALIFIER_RE.search(ql):
+        return None
+    index = index or column_index(df)
+    schema = schema or schema_profile(df)
+    cols = mentioned_columns(q, index)
+    found = _filter_value(ql, df, cols)
+    if found is _AMBIGUOUS:
+        return None
+    filter_col, filter_value = found if found else (None, None)
+    k_match = _TOP_K_RE.search(ql)
+    if _unexplained_words(ql, index, cols, filter_value, k_match):
+        return None
+    measures = [c for c in cols if schema.roles[c] == "measure"]
+    groups = [c for c in cols if schema.roles[c] == "dimension" and c != filter_col]
+    others = [c for c in cols if c not in measures and c not in groups and c != filter_col]
+    aggs = [name for name, rx in _AGG_RES if rx.search(ql)]
+
+    # Charts: one measure, plotted by one dimension or over time
+    if "bar chart" in ql or "bar plot" in ql:
+        if len(measures) == 1 and len(groups) == 1 and not found:
+            return {"kind": "bar_chart", "x": groups[0], "y": measures[0]}
+        return None
+    if "line chart" in ql or "line plot" in ql:
+        times = [c for c in others if schema.roles[c] == "datetime"] or schema.datetimes
+        if len(measures) == 1 and len(times) == 1 and not found:
+            return {"kind": "line_chart", "x": times[0], "y": measures[0]}
+        return None
+
+    if "correlation" in ql or "correlated" in ql:
+        if len(measures) == 2 and not found:
+            return {"kind": "correlation", "col_x": measures[0], "col_y": measures[1]}
+        return None
+
+    if _DISTINCT_RE.search(ql):
+        targets = groups + others or measures
+        if len(targets) == 1 and not found:
+            return {"kind": "count_distinct", "col": targets[0]}
+        return None
+
+    # Ranked groups: "top 3 products by sales", "which region has the highest sales"
+    bottom = _BOTTOM_RE.search(ql) is not None
+    if k_match or bottom or _TOP_RE.search(ql):
+        if len(groups) != 1 or len(measures) != 1 or found or others or len(aggs) > 1:
+            return None
+        agg = "mean" if aggs == ["mean"] else "sum"
+        if aggs and aggs[0] not in ("sum", "mean"):
+            return None
+        if k_match is None and not bottom and agg == "sum":
+            return {"kind": "group_sum_top", "group_col": groups[0], "sum_col": measures[0]}
+        k = int(_NUMBER_WORDS.get(k_match.group(1), k_match.group(1))) if k_match else 1
+        return {"kind": "top_k", "group_col": groups[0], "sum_col": measures[0], "k": k,
+                "agg": agg, "order": "asc" if bottom else "desc"}
+
+    if groups or others or len(aggs) > 1:
+        return None  # grouped or mixed questions need more than one number
+
+    # Counts: "how many rows", "how many orders in the North region"
+    if not aggs and _COUNT_ROWS_RE.search(ql) and not measures:
+        if found:
+            return {"kind": "filtered_agg", "agg": "count", "filter_col": filter_col, "value": filter_value}
+        if _ROW_WORDS_RE.search(ql):
+            return {"kind": "count_rows"}
+        return None
+
+    if len(aggs) == 1 and len(measures) == 1:
+        if found:
+            return {"kind": "filtered_agg", "agg": aggs[0], "col": measures[0],
+                    "filter_col": filter_col, "value": filter_value}
+        return {"kind": aggs[0], "col": measures[0]}
     return None
 
 
-def plan_csv_op(q: str, df: pd.DataFrame) -> Dict[str, Any]:
+def plan_csv_op(
+    q: str,
+    df: pd.DataFrame,
+    index: Optional[ColumnIndex] = None,
+    schema: Optional[SchemaProfile] = None
+) -> Dict[str, Any]:
     """
     Create a heuristic CSV operation plan from question.
-    Uses fuzzy matching on dataframe columns.
+    Uses fuzzy matching on dataframe columns (via `index`) and column
+    roles (via `schema`); both are built once per frame.
     """
     ql = q.lower()
-    cols = list(df.columns)
+    index = index or column_index(df)
+    schema = schema or schema_profile(df)
+    cols = index.columns
+
+    # Unambiguous questions get an exact plan; the rules below guess
+    plan = confident_plan(q, df, index, schema)
+    if plan is not None:
+        return plan
 
     # Count rows
     if "row" in ql and "count" in ql:
         return {"kind": "count_rows"}
 
-    # Look for a numeric column
-    num_cols = [c for c in cols if pd.api.types.is_numeric_dtype(df[c])]
-    text_cols = [c for c in cols if df[c].dtype == "object"]
+    # Measures to aggregate, dimensions to group by
+    num_cols = schema.measures
+    text_cols = schema.dimensions
 
     # Total of some column
     if "total" in ql or "sum" in ql:
-        target = _match_column("sales", cols) or (num_cols[0] if num_cols else None)
+        target = index.match("sales") or (num_cols[0] if num_cols else None)
         if target:
             return {"kind": "sum", "col": target}
 
     # Median
     if "median" in ql:
-        target = _match_column("sales", cols) or (num_cols[0] if num_cols else None)
+        target = index.match("sales") or (num_cols[0] if num_cols else None)
         if target:
             return {"kind": "median", "col": target}
 
@@ -95,8 +461,8 @@ def plan_csv_op(q: str, df: pd.DataFrame) -> Dict[str, Any]:
 
     # Group & top
     if "highest" in ql or "top" in ql:
-        group_col = _match_column("region", cols) or (text_cols[0] if text_cols else None)
-        sum_col = _match_column("sales", cols) or (num_cols[0] if num_cols else None)
+        group_col = index.match("region") or (text_cols[0] if text_cols else None)
+        sum_col = index.match("sales") or (num_cols[0] if num_cols else None)
         if group_col and sum_col:
             return {"kind": "group_sum_top", "group_col": group_col, "sum_col": sum_col}
 
@@ -104,7 +470,47 @@ def plan_csv_op(q: str, df: pd.DataFrame) -> Dict[str, Any]:
     if "bar chart" in ql:
         return {"kind": "bar_chart", "x": text_cols[0], "y": num_cols[0]} if text_cols and num_cols else {"kind": "count_rows"}
     if "line chart" in ql or "trend" in ql:
-        return {"kind": "line_chart", "x": cols[0], "y": num_cols[0]} if num_cols else {"kind": "count_rows"}
+        x = schema.datetimes[0] if schema.datetimes else cols[0]
+        return {"kind": "line_chart", "x": x, "y": num_cols[0]} if num_cols else {"kind": "count_rows"}
 
     # Default
     return {"kind": "count_rows"}
+
+
+def _named_value_columns(ql: str, df: pd.DataFrame) -> set:
+    """Columns holding any dimension value named in `ql` (every candidate when one is ambiguous)."""
+    values, longest = dimension_values(df)
+    words = _VALUE_WORDS_RE.findall(ql)
+    cols = set()
+    for i in range(len(words)):
+        for n in range(1, min(longest, len(words) - i) + 1):
+            hit = values.get(" ".join(words[i:i + n]))
+            if hit is _AMBIGUOUS:
+                schema = schema_profile(df)
+                cols.update(c for c in schema.dimensions if schema.cardinality[c] <= _FILTER_MAX_VALUES)
+            elif hit is not None:
+                cols.add(hit[0])
+    return cols
+
+
+def plan_projection(questions: Sequence[str], sample: pd.DataFrame) -> Optional[List[Any]]:
+    """
+    Columns a full load needs to answer `questions`, planned against a
+    sample of the dataset (io.read_sample): the columns each question
+    names, those its plan reads, those holding a value it names (a filter
+    such as "North"), and the datetime columns line charts fall back to.
+    Returns None (load everything) unless every question has a confident
+    plan: anything else goes to the LLM, whose dataset summary must show
+    every column. A filter value that only occurs past the sample is not
+    seen here.
+    """
+    index = column_index(sample)
+    schema = schema_profile(sample)
+    keep = set(schema.datetimes)
+    for q in questions:
+        plan = confident_plan(q, sample, index, schema)
+        if plan is None:
+            return None
+        keep.update(mentioned_columns(q, index), _named_value_columns(q.lower(), sample), plan_columns(plan))
+    # Keep one column even for row counts: a frame without columns has no rows
+    return [c for c in sample.columns if c in keep] or list(sample.columns[:1])
@@ -0,0 +1,256 @@
+# app/ratelimit.py
+"""
+Client-side scheduling of LLM calls: token buckets for requests/min and
+tokens/min, a shared pause when the server says to back off, priority
+ordering of queued calls, and jittered exponential backoff for retries.
+All waiting is done with asyncio sleeps; nothing blocks a thread.
+"""
+import asyncio
+import contextvars
+import email.utils
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, List, Optional, Tuple
+
+from app.metrics import Gauge
+
+# --- Rate limit settings (overridable via env; 0 disables a limit) ---
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+# Budget that may be spent in one burst, in seconds of quota (servers may
+# enforce per-minute limits over shorter windows)
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "1"))
+# Completion tokens reserved per call before the real usage is known
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "256"))
+
+# Lower runs first: API requests go ahead of CLI/batch work queued on the same process
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def request_priority(level: int):
+    """Queue LLM calls made inside this block at `level` (see PRIORITY_*)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class TokenBucket:
+    """
+    Continuous-refill bucket holding at most `burst_seconds` of budget.
+    Takes may overdraw it (a call's real token usage is only known
+    afterwards); the debt is paid back before anything else is let through.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_RATE_BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (capped at a full bucket)."""
+        self._refill(now)
+        need = min(amount, self.capacity) - self.level
+        return need / self.rate if need > 0 else 0.0
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= amount
+
+
+class RateLimiter:
+    """
+    Admits LLM calls within the request and token budgets. Callers wait in
+    one queue ordered by (priority, arrival); only the head waits on the
+    buckets, so a pause or a refill lets calls through one by one instead
+    of all at once. Safe to share between threads and event loops.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._paused_until = 0.0
+        self._queue: List[list] = []  # [priority, seq, tokens, loop, event, cancelled]
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.throttled = 0
+        self.pauses = 0
+        self.retries = 0
+
+    def _delay(self, tokens: float, now: float) -> float:
+        delay = self._paused_until - now
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(tokens, now))
+        return delay
+
+    def _take(self, tokens: float, now: float) -> None:
+        if self.requests is not None:
+            self.requests.take(1, now)
+        if self.tokens is not None:
+            self.tokens.take(tokens, now)
+        self.admitted += 1
+
+    def _head(self) -> Optional[list]:
+        while self._queue and self._queue[0][5]:
+            heapq.heappop(self._queue)
+        return self._queue[0] if self._queue else None
+
+    def _wake_head(self) -> None:
+        head = self._head()
+        if head is not None:
+            head[3].call_soon_threadsafe(head[4].set)
+
+    async def acquire(self, tokens: float = 0, priority: Optional[int] = None) -> None:
+        """Wait until one call estimated at `tokens` tokens may be sent."""
+        priority = current_priority() if priority is None else priority
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            now = time.monotonic()
+            if self._head() is None and self._delay(tokens, now) <= 0:
+                self._take(tokens, now)
+                return
+            entry = [priority, next(self._seq), tokens, loop, asyncio.Event(), False]
+            heapq.heappush(self._queue, entry)
+            self.throttled += 1
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    delay = self._delay(tokens, now) if self._head() is entry else None
+                    if delay is not None and delay <= 0:
+                        heapq.heappop(self._queue)
+                        self._take(tokens, now)
+                        self._wake_head()
+                        return
+                    entry[4].clear()
+                if delay is None:
+                    await entry[4].wait()  # until we reach the head of the queue
+                else:
+                    # A higher-priority arrival takes over the head and wakes on its own
+                    try:
+                        await asyncio.wait_for(entry[4].wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        except BaseException:
+            with self._lock:
+                entry[5] = True
+                self._wake_head()
+            raise
+
+    def settle(self, estimated: float, used: Optional[float]) -> None:
+        """Correct the token bucket once a call's real usage is known."""
+        if self.tokens is None or used is None:
+            return
+        with self._lock:
+            self.tokens.take(used - estimated, time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        """Hold every queued and new call for `seconds` (server said slow down)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.pauses += 1
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"admitted": self.admitted, "throttled": self.throttled, "pauses": self.pauses,
+                    "retries": self.retries, "queued": sum(not e[5] for e in self._queue)}
+
+
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE, cap: float = LLM_BACKOFF_MAX) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    if headers is None:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+def classify_error(exc: BaseException) -> Tuple[bool, bool, Optional[float]]:
+    """
+    (retryable, rate_limited, retry_after seconds) for an exception raised
+    by the OpenAI SDK: 429s, 408/409/5xx responses, timeouts and dropped
+    connections are retryable.
+    """
+    status = getattr(exc, "status_code", None)
+    response = getattr(exc, "response", None)
+    retry_after = _retry_after(getattr(response, "headers", None))
+    if status == 429 or "rate_limit_exceeded" in str(exc):
+        return True, True, retry_after
+    if status is not None:
+        return status in (408, 409) or status >= 500, False, retry_after
+    name = type(exc).__name__
+    return name in ("APIConnectionError", "APITimeoutError"), False, None
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter (LLM_RPM / LLM_TPM are per process), created on first use."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+Gauge("app_llm_queued_calls", "LLM calls waiting in the rate limiter queue.",
+      source=lambda: {(): _limiter.stats()["queued"] if _limiter is not None else 0})
+
+
+def configure_rate_limiter(rpm: float = LLM_RPM, tpm: float = LLM_TPM) -> RateLimiter:
+    """Replace the process-wide limiter (e.g. after a quota change, or in benchmarks)."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = RateLimiter(rpm, tpm)
+    return _limiter
@@ -2,15 +2,19 @@ from typing import Optional, List, Any
 import pandas as pd
 from app.qna import extract_questions, classify_question, plan_csv_op
 from app.csv_ops import execute_plan
-from app.web import answer_via_web
-from app.llm import LLMClient
+from app.web import extract_urls, scrape_website
+from app.retrieval import build_context, get_index
+from app.llm import get_llm, run_sync
 
 def process_inputs(questions_text: str, df: Optional[pd.DataFrame]) -> List[str]:
     """
     Main orchestrator: returns flat list of answers.
+    Questions are answered one at a time with the shared LLM client.
     """
-    llm = LLMClient()
+    llm = get_llm()
     questions = extract_questions(questions_text)
+    urls = extract_urls(questions_text)
+    pages = [get_index(u, scrape_website(u)) for u in urls]
     answers: List[str] = []
 
     for q in questions:
@@ -19,14 +23,14 @@ def process_inputs(questions_text: str, df: Optional[pd.DataFrame]) -> List[str]
         if route == "csv" and df is not None:
             plan = plan_csv_op(q, df)
             result = execute_plan(plan, df)
-            final = llm.phrase_csv_answer(q, result["summary"], result.get("metrics", {})) \
+            final = run_sync(llm.phrase_csv_answer(q, result["summary"], result.get("metrics", {}))) \
                     if not llm.disabled else result["summary"]
             answers.append(final)
 
         else:
-            web_result = answer_via_web(q)
-            final = llm.phrase_web_answer(q, web_result.get("snippets", []), web_result.get("sources", [])) \
-                    if not llm.disabled else web_result.get("synthesis", "No answer.")
+            context = build_context([q], pages)
+            final = run_sync(llm.answer_with_context(q, context)) \
+                    if not llm.disabled else (context or "No answer.")
             answers.append(final)
 
     return answers
@@ -0,0 +1,155 @@
+# app/retrieval.py
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+# --- Retrieval settings (overridable via env) ---
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "1000"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "800"))
+_INDEX_CACHE_SIZE = 32
+
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from has have how in is it its of on or "
+    "the this that to was were what when where which who whom why with".split()
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _tokens(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _is_table(block: str) -> bool:
+    lines = block.splitlines()
+    return len(lines) > 1 and all("," in line for line in lines[:3])
+
+
+def chunk_text(text: str, max_chars: int = RETRIEVAL_CHUNK_CHARS) -> List[str]:
+    """
+    Split scraped text into retrieval chunks. Paragraphs are merged up to
+    `max_chars`; CSV tables are split into row groups that each repeat the
+    header line, so every chunk is readable on its own.
+    """
+    chunks: List[str] = []
+    buf = ""
+    for block in (b.strip() for b in text.split("\n\n")):
+        if not block:
+            continue
+        if _is_table(block):
+            if buf:
+                chunks.append(buf)
+                buf = ""
+            header, *rows = block.splitlines()
+            group = header
+            for row in rows:
+                if len(group) + len(row) + 1 > max_chars and group != header:
+                    chunks.append(group)
+                    group = header
+                group += "\n" + row
+            chunks.append(group)
+        elif buf and len(buf) + len(block) + 2 > max_chars:
+            chunks.append(buf)
+            buf = block
+        else:
+            buf = f"{buf}\n\n{block}" if buf else block
+    if buf:
+        chunks.append(buf)
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of text chunks."""
+
+    def __init__(self, chunks: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.chunks = list(chunks)
+        self.k1, self.b = k1, b
+        self._tf = [Counter(_tokens(c)) for c in self.chunks]
+        self._len = [sum(tf.values()) for tf in self._tf]
+        self._avg = (sum(self._len) / len(self._len)) if self._len else 0.0
+        df = Counter(term for tf in self._tf for term in tf)
+        n = len(self.chunks)
+        self._idf = {t: math.log(1 + (n - d + 0.5) / (d + 0.5)) for t, d in df.items()}
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> List[Tuple[float, int]]:
+        """Top-k (score, chunk index) pairs with a positive score, best first."""
+        terms = [t for t in set(_tokens(query)) if t in self._idf]
+        if not terms:
+            return []
+        scored = []
+        for i, tf in enumerate(self._tf):
+            norm = self.k1 * (1 - self.b + self.b * self._len[i] / (self._avg or 1))
+            score = 0.0
+            for t in terms:
+                f = tf.get(t)
+                if f:
+                    score += self._idf[t] * f * (self.k1 + 1) / (f + norm)
+            if score > 0:
+                scored.append((score, i))
+        scored.sort(reverse=True)
+        return scored[:k]
+
+
+_indexes: "OrderedDict[Tuple[str, str], BM25Index]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_index(url: str, text: str) -> BM25Index:
+    """Chunked BM25 index of one scraped page, cached per URL (and page content)."""
+    key = (url, hashlib.sha1(text.encode("utf-8", "ignore")).hexdigest())
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = BM25Index(chunk_text(text))
+    with _lock:
+        _indexes[key] = index
+        while len(_indexes) > _INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def build_context(
+    questions: Sequence[str],
+    indexes: Sequence[BM25Index],
+    token_budget: int = RETRIEVAL_TOKEN_BUDGET,
+    k: int = RETRIEVAL_TOP_K,
+) -> str:
+    """
+    Context for one or more questions: each question's top-k chunks across
+    all pages, taken round-robin (best first) until the token budget is
+    spent, then emitted in page order. With no matches at all, the leading
+    chunks of each page are used instead.
+    """
+    ranked: List[List[Tuple[int, int]]] = []
+    for q in questions:
+        hits = [(score, p, i) for p, index in enumerate(indexes) for score, i in index.search(q, k)]
+        hits.sort(reverse=True)
+        ranked.append([(p, i) for _, p, i in hits[:k]])
+    if not any(ranked):
+        ranked = [[(p, i) for p, index in enumerate(indexes) for i in range(len(index.chunks))]]
+
+    chosen: Dict[Tuple[int, int], None] = {}
+    used = 0
+    for depth in range(max(len(r) for r in ranked)):
+        for r in ranked:
+            if depth >= len(r) or r[depth] in chosen:
+                continue
+            p, i = r[depth]
+            cost = estimate_tokens(indexes[p].chunks[i])
+            if used + cost > token_budget:
+                continue
+            chosen[r[depth]] = None
+            used += cost
+
+    return "\n\n".join(indexes[p].chunks[i] for p, i in sorted(chosen))
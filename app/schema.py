@@ -0,0 +1,157 @@
+# app/schema.py
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+# --- Schema profiling settings (overridable via env) ---
+# Cardinality of non-categorical columns is estimated on this many rows
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "10000"))
+# Text columns are dimensions up to this many distinct values (or share of rows);
+# beyond that, nearly-unique ones are identifiers and the rest free text
+_DIMENSION_MAX_UNIQUE = 1000
+_DIMENSION_MAX_RATIO = 0.5
+_IDENTIFIER_MIN_RATIO = 0.9
+
+ROLES = ("measure", "dimension", "datetime", "identifier", "text")
+
+
+def _kind(dtype: Any) -> str:
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "category"
+    if pd.api.types.is_string_dtype(dtype):
+        return "text"
+    return "other"
+
+
+def _role(kind: str, unique: int, count: int) -> str:
+    if kind == "numeric":
+        return "measure"
+    if kind == "datetime":
+        return "datetime"
+    if kind == "bool":
+        return "dimension"
+    if unique <= _DIMENSION_MAX_UNIQUE or unique <= _DIMENSION_MAX_RATIO * count:
+        return "dimension"
+    if unique >= _IDENTIFIER_MIN_RATIO * count:
+        return "identifier"
+    return "text"
+
+
+class SchemaProfile:
+    """
+    Column types, cardinality, null counts and likely role of every column
+    of a dataset, computed once and shared by planning, plan execution and
+    prompt building. Roles: "measure" (numeric), "datetime", "dimension"
+    (bool or low-cardinality text), "identifier" (text that is nearly
+    unique per row) and "text". Cardinality of categoricals is read from
+    the dtype; for other columns it is estimated on a sample.
+    """
+
+    def __init__(self, df: Optional[pd.DataFrame] = None, sample_rows: int = SCHEMA_SAMPLE_ROWS):
+        self.rows = 0
+        self.columns: List[Any] = []
+        self.dtypes: Dict[Any, str] = {}
+        self.kinds: Dict[Any, str] = {}
+        self.nulls: Dict[Any, int] = {}
+        self.cardinality: Dict[Any, int] = {}
+        self.roles: Dict[Any, str] = {}
+        self.measures: List[Any] = []
+        self.dimensions: List[Any] = []
+        self.datetimes: List[Any] = []
+        if df is None:
+            return
+
+        self.rows = len(df)
+        self.columns = list(df.columns)
+        sample = df if len(df) <= sample_rows else df.sample(sample_rows, random_state=0)
+        nulls = df.isna().sum()
+        counts = sample.count()
+        uniques = sample.nunique()
+        for c, t in df.dtypes.items():
+            kind = _kind(t)
+            unique = len(t.categories) if kind == "category" else int(uniques[c])
+            self.dtypes[c] = str(t)
+            self.kinds[c] = kind
+            self.nulls[c] = int(nulls[c])
+            self.cardinality[c] = unique
+            self.roles[c] = _role(kind, unique, int(counts[c]))
+        self._group_roles()
+
+    @classmethod
+    def from_chunk_summary(cls, summary: Dict[str, Any]) -> "SchemaProfile":
+        """Schema from io.summarize_csv_chunks output (cardinality capped by its tracking)."""
+        schema = cls()
+        schema.rows = summary["rows"]
+        schema.columns = list(summary["columns"])
+        for c, s in summary["columns"].items():
+            kind = "numeric" if "mean" in s else _kind(s["dtype"])
+            unique = s.get("unique", 0)
+            if isinstance(unique, str):  # ">N": stopped counting
+                unique = int(unique.lstrip(">")) + 1
+            schema.dtypes[c] = s["dtype"]
+            schema.kinds[c] = kind
+            schema.nulls[c] = s["nulls"]
+            schema.cardinality[c] = unique
+            schema.roles[c] = _role(kind, unique, s["count"])
+        schema._group_roles()
+        return schema
+
+    def _group_roles(self) -> None:
+        self.measures = self.with_role("measure")
+        self.dimensions = self.with_role("dimension")
+        self.datetimes = self.with_role("datetime")
+
+    def null_ratio(self, col: Any) -> float:
+        return self.nulls[col] / self.rows if self.rows else 0.0
+
+    def with_role(self, *roles: str) -> List[Any]:
+        """Columns having any of `roles`, in column order."""
+        return [c for c in self.columns if self.roles[c] in roles]
+
+    def is_numeric(self, col: Any) -> bool:
+        return self.kinds.get(col) == "numeric"
+
+    def describe(self, columns: Optional[Sequence[Any]] = None) -> str:
+        """One-line column list with roles, for LLM prompts."""
+        parts = []
+        for c in self.columns if columns is None else columns:
+            role = self.roles[c]
+            extra = f", {self.cardinality[c]} values" if role == "dimension" else ""
+            parts.append(f"{c} ({role}, {self.dtypes[c]}{extra})")
+        return "; ".join(parts)
+
+
+_frames: Dict[int, Tuple[Any, Any, Dict[Any, Any]]] = {}
+_frames_lock = threading.Lock()
+
+
+def for_frame(df: pd.DataFrame, build: Callable[[pd.DataFrame], Any]) -> Any:
+    """
+    `build(df)`, memoized per live DataFrame while its columns are
+    unchanged. Rebuild by hand (call `build` directly) after changing
+    dtypes in place.
+    """
+    key = id(df)
+    with _frames_lock:
+        cached = _frames.get(key)
+        if cached is None or cached[0]() is not df or cached[1] is not df.columns:
+            ref = weakref.ref(df, lambda _, key=key: _frames.pop(key, None))
+            cached = _frames[key] = (ref, df.columns, {})
+        results = cached[2]
+    if build not in results:
+        results[build] = build(df)
+    return results[build]
+
+
+def schema_profile(df: pd.DataFrame) -> SchemaProfile:
+    """SchemaProfile of a DataFrame, computed once per frame."""
+    return for_frame(df, SchemaProfile)
@@ -1,21 +1,215 @@
+import asyncio
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
 import requests
 import pandas as pd
 from bs4 import BeautifulSoup
 from io import StringIO
 
-def scrape_website(url: str) -> str:
+from app.metrics import timed
+
+try:
+    import lxml.html
+except ImportError:  # fall back to BeautifulSoup's pure-Python parser
+    lxml = None
+
+# --- Fetch / cache settings (overridable via env) ---
+WEB_TIMEOUT = float(os.getenv("WEB_TIMEOUT", "20"))
+WEB_MAX_CONNECTIONS = int(os.getenv("WEB_MAX_CONNECTIONS", "10"))
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", "3600"))
+WEB_CACHE_MAX_ENTRIES = int(os.getenv("WEB_CACHE_MAX_ENTRIES", "128"))
+
+_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; Bot/0.1)"}
+_TEXT_TAGS = ("p", "h1", "h2", "h3")
+_TABLE_ROWS = 10  # data rows kept per table
+_WS_RE = re.compile(r"\s+")
+URL_RE = re.compile(r"https?://[^\s<>\"')\]]+")
+
+# url -> (etag, last_modified, html): validators for conditional re-fetches
+_http_cache: "OrderedDict[str, Tuple[Optional[str], Optional[str], str]]" = OrderedDict()
+# url -> (extracted_at, text): skip fetching entirely while fresh
+_text_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Pooled clients: one requests.Session for sync callers, one httpx client per event loop
+_session: Optional[requests.Session] = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def extract_urls(text: str) -> List[str]:
+    """All distinct http(s) URLs in `text`, in order of appearance."""
+    seen, out = set(), []
+    for url in URL_RE.findall(text):
+        url = url.rstrip(".,;:")
+        if url not in seen:
+            seen.add(url)
+            out.append(url)
+    return out
+
+
+def _lru_put(cache: OrderedDict, key, value) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > WEB_CACHE_MAX_ENTRIES:
+        cache.popitem(last=False)
+
+
+def _fresh_text(url: str) -> Optional[str]:
+    with _cache_lock:
+        hit = _text_cache.get(url)
+        if hit and time.time() - hit[0] < WEB_CACHE_TTL:
+            _text_cache.move_to_end(url)
+            return hit[1]
+    return None
+
+
+def _conditional_headers(url: str) -> Dict[str, str]:
+    headers = dict(_HEADERS)
+    with _cache_lock:
+        cached = _http_cache.get(url)
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def _resolve(url: str, status: int, headers, body: str) -> Tuple[Optional[str], bool]:
     """
-    Scrape main readable content + tables from a Wikipedia article.
+    Return (html, changed) for a response, serving 304s from the HTTP cache
+    and remembering validators of fresh 200s. html is None for a 304 whose
+    cached body has been evicted since: fetch again without validators.
+    """
+    with _cache_lock:
+        if status == 304:
+            if url not in _http_cache:
+                return None, True
+            _http_cache.move_to_end(url)
+            return _http_cache[url][2], False
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if etag or last_modified:
+            _lru_put(_http_cache, url, (etag, last_modified, body))
+    return body, True
+
+
+def _remember_text(url: str, text: str) -> None:
+    with _cache_lock:
+        _lru_put(_text_cache, url, (time.time(), text))
+
+
+def _cached_text(url: str) -> Optional[str]:
+    """Last extracted text for `url`, fresh or not (for 304 revalidations)."""
+    with _cache_lock:
+        hit = _text_cache.get(url)
+    return hit[1] if hit else None
+
+
+def _cell_text(el) -> str:
+    return _WS_RE.sub(" ", el.text_content()).strip()
+
+
+def _span(cell, attr: str) -> int:
+    value = cell.get(attr, "1").strip()
+    return max(int(value), 1) if value.isdigit() else 1
+
+
+def _table_to_frame(table, max_rows: int = _TABLE_ROWS) -> pd.DataFrame:
+    """
+    Build a DataFrame straight from a parsed <table>: leading all-<th> rows
+    form the header, colspan/rowspan are expanded, and only the first
+    `max_rows` data rows are read. Nested tables are skipped.
+    """
+    header: List[List[str]] = []
+    rows: List[List[str]] = []
+    pending: Dict[int, List] = {}  # column -> [rows left, text] from a rowspan above
+
+    for tr in table.iter("tr"):
+        if next(tr.iterancestors("table")) is not table:
+            continue
+        cells = [c for c in tr if c.tag in ("th", "td")]
+        queue = [(_cell_text(c), _span(c, "colspan"), _span(c, "rowspan")) for c in cells]
+        row: List[str] = []
+        while queue or len(row) in pending:
+            col = len(row)
+            if col in pending:
+                pending[col][0] -= 1
+                row.append(pending[col][1])
+                if pending[col][0] == 0:
+                    del pending[col]
+                continue
+            text, across, down = queue.pop(0)
+            for _ in range(across):
+                if down > 1:
+                    pending[len(row)] = [down - 1, text]
+                row.append(text)
+        if not row:
+            continue
+        if not rows and cells and all(c.tag == "th" for c in cells):
+            header.append(row)
+            continue
+        rows.append(row)
+        if len(rows) >= max_rows:
+            break
+
+    width = max([len(r) for r in header + rows] or [0])
+    rows = [r + [""] * (width - len(r)) for r in rows]
+    if not header:
+        return pd.DataFrame(rows)
+    levels = [r + [""] * (width - len(r)) for r in header]
+    names = [" ".join(dict.fromkeys(p for p in parts if p)) for parts in zip(*levels)]
+    return pd.DataFrame(rows, columns=names)
+
+
+def _extract_lxml(html: str) -> str:
+    """
+    One lxml parse, one walk of the content div: text blocks and wikitables
+    are collected in document order, tables converted without re-parsing.
+    """
+    doc = lxml.html.fromstring(html)
+    found = doc.xpath('//div[@id="mw-content-text"]')
+    if not found:
+        return "No content section found."
+
+    texts, tables = [], []
+    for el in found[0].iter(*_TEXT_TAGS, "table"):
+        if el.tag == "table":
+            if "wikitable" in el.get("class", "").split():
+                try:
+                    tables.append(_table_to_frame(el).to_csv(index=False))
+                except Exception:
+                    continue
+        else:
+            text = _cell_text(el)
+            if text:
+                texts.append(text)
+
+    return "\n\n".join(texts + tables)
+
+
+@timed("web.extract")
+def extract_content(html: str) -> str:
+    """
+    Main readable content + tables from a Wikipedia article's HTML.
     Returns combined plain text and table CSV snippets.
     """
-    try:
-        headers = {"User-Agent": "Mozilla/5.0 (compatible; Bot/0.1)"}
-        response = requests.get(url, headers=headers, timeout=20)
-        response.raise_for_status()
-    except Exception as e:
-        return f"Failed to fetch {url}: {e}"
+    if lxml is not None:
+        return _extract_lxml(html)
+    return _extract_bs4(html)
 
-    soup = BeautifulSoup(response.text, "html.parser")
+
+def _extract_bs4(html: str) -> str:
+    """BeautifulSoup + pd.read_html extraction, used when lxml is missing."""
+    soup = BeautifulSoup(html, "html.parser")
 
     # ✅ Wikipedia: main article text lives in <div id="mw-content-text">
     content_div = soup.find("div", {"id": "mw-content-text"})
@@ -39,3 +233,98 @@ def scrape_website(url: str) -> str:
 
     combined = "\n\n".join(texts + tables)
     return combined
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _client_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=WEB_MAX_CONNECTIONS)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=WEB_TIMEOUT,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=WEB_MAX_CONNECTIONS),
+            )
+            _async_clients[loop] = client
+        return client
+
+
+@timed("web.scrape")
+def scrape_website(url: str) -> str:
+    """
+    Scrape main readable content + tables from a Wikipedia article.
+    Returns combined plain text and table CSV snippets.
+    Blocking; async code should use scrape_website_async.
+    """
+    text = _fresh_text(url)
+    if text is not None:
+        return text
+    try:
+        response = _get_session().get(url, headers=_conditional_headers(url), timeout=WEB_TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+        html, changed = _resolve(url, response.status_code, response.headers, response.text)
+        if html is None:
+            response = _get_session().get(url, headers=_HEADERS, timeout=WEB_TIMEOUT)
+            response.raise_for_status()
+            html, changed = _resolve(url, response.status_code, response.headers, response.text)
+    except Exception as e:
+        return f"Failed to fetch {url}: {e}"
+
+    text = None if changed else _cached_text(url)
+    if text is None:
+        text = extract_content(html)
+    _remember_text(url, text)
+    return text
+
+
+@timed("web.scrape")
+async def scrape_website_async(url: str) -> str:
+    """
+    Async scrape_website: pooled connections, conditional re-fetches and a
+    TTL cache of extracted text. HTML parsing runs in a worker thread.
+    """
+    text = _fresh_text(url)
+    if text is not None:
+        return text
+    try:
+        client = _get_async_client()
+        response = await client.get(url, headers=_conditional_headers(url))
+        if response.status_code != 304:
+            response.raise_for_status()
+        html, changed = _resolve(url, response.status_code, response.headers, response.text)
+        if html is None:
+            response = await client.get(url, headers=_HEADERS)
+            response.raise_for_status()
+            html, changed = _resolve(url, response.status_code, response.headers, response.text)
+    except Exception as e:
+        return f"Failed to fetch {url}: {e}"
+
+    text = None if changed else _cached_text(url)
+    if text is None:
+        text = await asyncio.to_thread(extract_content, html)
+    _remember_text(url, text)
+    return text
+
+
+async def scrape_many(urls: List[str]) -> List[str]:
+    """Scrape several URLs concurrently; results follow the order of `urls`."""
+    return list(await asyncio.gather(*(scrape_website_async(u) for u in urls)))
+
+
+async def aclose_web_client() -> None:
+    """Close the current event loop's pooled client (call on shutdown)."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
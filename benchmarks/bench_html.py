@@ -0,0 +1,53 @@
+# benchmarks/bench_html.py
+"""
+HTML extraction: the lxml single-pass engine against the BeautifulSoup +
+pd.read_html path, on every saved page in benchmarks/html/.
+
+    python -m benchmarks.bench_html [--repeat 5] [--out results.json]
+
+Drop real pages there (e.g. a saved Wikipedia list article) to benchmark
+them; a synthetic list page is generated if the directory is empty.
+"""
+import argparse
+import json
+import time
+
+from app.web import _extract_bs4, _extract_lxml
+from benchmarks.synthetic import html_fixtures
+
+
+def _best_of(fn, html: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(html)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(repeat: int = 5) -> list:
+    results = []
+    for path in html_fixtures():
+        html = path.read_text(encoding="utf-8", errors="ignore")
+        bs4_s = _best_of(_extract_bs4, html, repeat)
+        lxml_s = _best_of(_extract_lxml, html, repeat)
+        results.append({
+            "page": path.name,
+            "bytes": len(html),
+            "bs4_read_html_s": round(bs4_s, 4),
+            "lxml_single_pass_s": round(lxml_s, 4),
+            "speedup": round(bs4_s / lxml_s, 1) if lxml_s else None,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    results = run(args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,89 @@
+# benchmarks/bench_questions.py
+"""
+Question extraction: the streaming single-pattern extractor against the
+previous re.split implementation, on synthetic question logs.
+
+    python -m benchmarks.bench_questions [--sizes 1 10 50] [--repeat 3] [--out results.json]
+
+Sizes are in MB. Times are best-of-`repeat`; peak memory is measured in a
+separate tracemalloc run and includes the input string where one is held.
+"""
+import argparse
+import json
+import re
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List
+
+from app.qna import extract_questions, iter_questions
+from benchmarks.synthetic import make_question_log
+
+
+def legacy_extract_questions(text: str) -> List[str]:
+    """extract_questions as it was before the streaming extractor."""
+    parts = re.split(r'(?<=\?)|\bQ\d*[:.)]', text)
+    qs = []
+    for p in parts:
+        p = p.strip()
+        if len(p.split()) >= 3 and p.endswith("?"):
+            qs.append(p)
+    seen, out = set(), []
+    for q in qs:
+        low = q.lower()
+        if low not in seen:
+            seen.add(low)
+            out.append(q)
+    return out
+
+
+def _stream_file(path: Path) -> int:
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for _ in iter_questions(f))
+
+
+def _measure(fn, arg, repeat: int) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(arg)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    count = out if isinstance(out, int) else len(out)
+    return {"seconds": round(best, 4), "peak_mb": round(peak / 2**20, 1), "questions": count}
+
+
+def run(sizes=(1, 10, 50), repeat: int = 3) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            text = make_question_log(size)
+            path = Path(tmp) / f"questions_{size}mb.txt"
+            path.write_text(text, encoding="utf-8")
+            row = {
+                "size_mb": size,
+                "legacy_split": _measure(legacy_extract_questions, text, repeat),
+                "single_pass": _measure(extract_questions, text, repeat),
+                "streamed_from_file": _measure(_stream_file, path, repeat),
+            }
+            assert row["legacy_split"]["questions"] == row["single_pass"]["questions"]
+            row["speedup"] = round(row["legacy_split"]["seconds"] / row["single_pass"]["seconds"], 1)
+            results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    results = run(args.sizes, args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
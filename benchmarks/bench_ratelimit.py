@@ -0,0 +1,95 @@
+# benchmarks/bench_ratelimit.py
+"""
+LLM call scheduling against benchmarks.fake_openai with a server-side
+quota and injected 429s: throughput and 429s with and without the
+client-side rate limiter, and how long interactive calls wait behind a
+queued batch.
+
+    python -m benchmarks.bench_ratelimit [--rpm 1200] [--calls 200] [--error-rate 0.02] [--out results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from benchmarks.fake_openai import start_server
+
+
+async def _timed(llm, i: int, priority: int) -> float:
+    """Seconds one call took, or None if it failed after all retries."""
+    from app.ratelimit import request_priority
+
+    t0 = time.perf_counter()
+    with request_priority(priority):
+        try:
+            await llm._achat(llm._messages(f"Say hello #{i}"))
+        except Exception:
+            return None
+    return time.perf_counter() - t0
+
+
+async def _burst(llm, calls: int, interactive: int = 0, delay: float = 1.0) -> dict:
+    from app.ratelimit import PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+    batch = [asyncio.ensure_future(_timed(llm, i, PRIORITY_BATCH)) for i in range(calls)]
+    await asyncio.sleep(delay)
+    inter = [asyncio.ensure_future(_timed(llm, calls + i, PRIORITY_INTERACTIVE)) for i in range(interactive)]
+    batch_s = await asyncio.gather(*batch)
+    inter_s = await asyncio.gather(*inter)
+    done_b = [s for s in batch_s if s is not None]
+    done_i = [s for s in inter_s if s is not None]
+    return {
+        "failed": len(batch_s) + len(inter_s) - len(done_b) - len(done_i),
+        "batch_p50_s": round(statistics.median(done_b), 3) if done_b else None,
+        "interactive_p50_s": round(statistics.median(done_i), 3) if done_i else None,
+    }
+
+
+def run(rpm: float = 1200, calls: int = 200, error_rate: float = 0.02, latency: float = 0.05) -> list:
+    server = start_server(latency=latency, rpm=rpm, error_rate=error_rate, retry_after=0.5)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+    from app.llm import LLMClient
+    from app.ratelimit import configure_rate_limiter
+
+    results = []
+    for name, client_rpm in (("no_client_limiter", 0), ("client_limiter", rpm)):
+        limiter = configure_rate_limiter(rpm=client_rpm, tpm=0)
+        llm = LLMClient(use_cache=False, max_concurrency=64)
+        server.reset_stats()
+        t0 = time.perf_counter()
+        timings = asyncio.run(_burst(llm, calls, interactive=10))
+        elapsed = time.perf_counter() - t0
+        stats = server.stats()
+        results.append({
+            "mode": name,
+            "quota_rpm": rpm,
+            "calls": calls + 10,
+            "elapsed_s": round(elapsed, 2),
+            "achieved_rpm": round((calls + 10) / elapsed * 60, 1),
+            "server_requests": stats["requests"],
+            "quota_429s": stats["quota_429"],
+            "injected_429s": stats["injected_429"],
+            "client_retries": limiter.stats()["retries"],
+            **timings,
+        })
+    server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpm", type=float, default=1200)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    results = run(args.rpm, args.calls, args.error_rate, args.latency)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,363 @@
+# benchmarks/bench_suite.py
+"""
+End-to-end and component benchmarks on synthetic sales data, with
+benchmarks.fake_openai standing in for the LLM (no network, no key).
+
+    python -m benchmarks.bench_suite [--preset quick|full] [--only api main.run ...] [--out results.json]
+    python -m benchmarks.bench_suite --compare before.json after.json
+
+Datasets are a row sweep (1K .. 10M rows at the narrow width) and a width
+sweep (up to 500 columns at 100K rows), generated once into
+benchmarks/data/ (with gzip, Parquet and Feather copies for the
+read_dataset bench). Each result has p50/p99/mean latency, throughput and
+the peak RSS sampled while it ran. The LLM response cache and the
+dataset cache are off unless --warm-caches is given, so every run pays
+for parsing and LLM calls. The fake LLM runs in this process.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from benchmarks.fake_openai import start_server
+from benchmarks.synthetic import SALES_FORMATS, HTML_DIR, html_fixtures, make_sales_csv, make_sales_questions, sales_as
+
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "quick": {"rows": [1_000, 100_000], "columns": [8, 50], "questions": [10], "repeat": 5, "e2e_repeat": 3},
+    "full": {"rows": [1_000, 10_000, 100_000, 1_000_000, 10_000_000], "columns": [8, 100, 500],
+             "questions": [10, 30, 100], "repeat": 5, "e2e_repeat": 3},
+}
+# The width sweep runs at this many rows (or the largest row count, if smaller)
+WIDE_ROWS = 100_000
+BENCHES = ("extract_questions", "plan_csv_op", "execute_plan", "read_csv", "read_dataset", "scrape_website",
+           "main.run", "api")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+class PeakRSS:
+    """Highest process RSS seen while the block runs, sampled every `interval` seconds."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self) -> "PeakRSS":
+        from app.metrics import current_rss
+
+        self._sample = current_rss
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._sample())
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._sample())
+
+
+def measure(fn: Callable[[], Any], repeat: int, unit: str = "calls/s", items_per_call: int = 1) -> Dict[str, Any]:
+    """
+    Run `fn` `repeat` times. If `fn` returns a list of latencies (benches
+    timing many small calls) those are the samples; otherwise each call is
+    one sample, processing `items_per_call` items for the throughput.
+    """
+    times: List[float] = []
+    items = 0
+    with PeakRSS() as mem:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = fn()
+            elapsed = time.perf_counter() - t0
+            if isinstance(out, list) and out and isinstance(out[0], float):
+                times.extend(out)
+                items += len(out)
+            else:
+                times.append(elapsed)
+                items += items_per_call
+    total = sum(times)
+    return {
+        "runs": len(times),
+        "p50_s": round(statistics.median(times), 6),
+        "p99_s": round(percentile(times, 99), 6),
+        "mean_s": round(total / len(times), 6),
+        "throughput": round(items / total, 2) if total else None,
+        "unit": unit,
+        "peak_rss_mb": round(mem.peak / 2 ** 20, 1),
+    }
+
+
+# --- Benches ---
+
+def bench_extract_questions(question_counts: List[int], repeat: int) -> List[dict]:
+    from app.qna import extract_questions
+
+    out = []
+    for n in question_counts:
+        text = make_sales_questions(n)
+        assert len(extract_questions(text)) == n
+        out.append({"bench": "extract_questions", "questions": n,
+                    **measure(lambda: extract_questions(text), repeat * 20, unit="files/s")})
+    return out
+
+
+def _timed_each(fn: Callable, items: List[Any]) -> List[float]:
+    times = []
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def bench_csv(path: Path, rows: int, columns: int, questions: List[str], repeat: int, benches: set) -> List[dict]:
+    from app.csv_ops import execute_plan
+    from app.io import load_csv_optional, read_sample
+    from app.qna import column_index, plan_csv_op, plan_projection
+    from app.schema import schema_profile
+
+    out = []
+    tags = {"rows": rows, "columns": columns}
+    if "read_csv" in benches:
+        out.append({"bench": "read_csv", **tags,
+                    **measure(lambda: load_csv_optional(str(path)), max(repeat // 2, 1), "rows/s", rows)})
+    if "read_dataset" in benches:
+        # Every format read whole, then sampled + planned + read with only the questions' columns
+        for fmt in SALES_FORMATS:
+            source = str(sales_as(path, fmt))
+            out.append({"bench": "read_dataset", **tags, "format": fmt, "projected": False,
+                        **measure(lambda: load_csv_optional(source), max(repeat // 2, 1), "rows/s", rows)})
+            load = lambda: load_csv_optional(source, columns=plan_projection(questions, read_sample(source)))
+            out.append({"bench": "read_dataset", **tags, "format": fmt, "projected": True,
+                        **measure(load, max(repeat // 2, 1), "rows/s", rows)})
+    if not benches & {"plan_csv_op", "execute_plan"}:
+        return out
+
+    df = load_csv_optional(str(path))
+    index, schema = column_index(df), schema_profile(df)
+    if "plan_csv_op" in benches:
+        out.append({"bench": "plan_csv_op", **tags, "questions": len(questions),
+                    **measure(lambda: _timed_each(lambda q: plan_csv_op(q, df, index, schema), questions),
+                              repeat, unit="plans/s")})
+    if "execute_plan" in benches:
+        plans = [plan_csv_op(q, df, index, schema) for q in questions]
+        out.append({"bench": "execute_plan", **tags, "plans": len(plans),
+                    **measure(lambda: _timed_each(lambda p: execute_plan(p, df, schema), plans),
+                              repeat, unit="plans/s")})
+    return out
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def bench_scrape(repeat: int) -> List[dict]:
+    from app import web
+
+    pages = html_fixtures()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=str(HTML_DIR)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    out = []
+    try:
+        for page in pages:
+            url = f"http://127.0.0.1:{server.server_address[1]}/{page.name}"
+
+            def cold() -> None:
+                web._text_cache.clear()
+                web._http_cache.clear()
+                web.scrape_website(url)
+
+            out.append({"bench": "scrape_website", "page": page.name, "bytes": page.stat().st_size,
+                        **measure(cold, repeat, unit="pages/s")})
+    finally:
+        server.shutdown()
+    return out
+
+
+def bench_main_run(path: Path, rows: int, columns: int, questions_file: Path, n: int, repeat: int) -> dict:
+    from app.main import run as main_run
+
+    def once() -> None:
+        # main.run prints the answers and writes report.json to the cwd
+        with contextlib.redirect_stdout(io.StringIO()):
+            main_run(str(questions_file), str(path))
+
+    return {"bench": "main.run", "rows": rows, "columns": columns, "questions": n,
+            **measure(once, repeat, unit="runs/s")}
+
+
+def bench_api(client, path: Path, rows: int, columns: int, questions_text: str, n: int, repeat: int) -> dict:
+    def once() -> None:
+        with open(path, "rb") as f:
+            r = client.post("/", files={"questions_txt": ("questions.txt", questions_text.encode(), "text/plain"),
+                                        "data": (path.name, f, "text/csv")})
+        r.raise_for_status()
+
+    return {"bench": "api", "rows": rows, "columns": columns, "questions": n,
+            **measure(once, repeat, unit="requests/s")}
+
+
+# --- Runner ---
+
+def datasets(rows: List[int], columns: List[int]) -> List[tuple]:
+    """Row sweep at the narrowest width plus width sweep at WIDE_ROWS."""
+    narrow = min(columns)
+    wide_rows = min(WIDE_ROWS, max(rows))
+    shapes = [(r, narrow) for r in sorted(rows)] + [(wide_rows, c) for c in sorted(columns) if c != narrow]
+    return list(dict.fromkeys(shapes))
+
+
+def _meta(args: argparse.Namespace, preset: Dict[str, Any]) -> dict:
+    import pandas as pd
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "preset": args.preset,
+        "config": preset,
+        "llm": {"latency_s": args.llm_latency, "error_rate": args.llm_error_rate, "rpm": args.llm_rpm},
+        "warm_caches": args.warm_caches,
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    preset = dict(PRESETS[args.preset])
+    for key in ("rows", "columns", "questions"):
+        if getattr(args, key):
+            preset[key] = getattr(args, key)
+    if args.repeat:
+        preset["repeat"] = preset["e2e_repeat"] = args.repeat
+    benches = set(args.only or BENCHES)
+
+    # Before any app import: settings are read at import time
+    server = start_server(latency=args.llm_latency, error_rate=args.llm_error_rate, rpm=args.llm_rpm, retry_after=0.5)
+    tmp = tempfile.TemporaryDirectory(prefix="bench-suite-")
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "fake"
+    os.environ["STORAGE_DIR"] = tmp.name
+    if not args.warm_caches:
+        os.environ["LLM_CACHE"] = "0"
+        os.environ["DATASET_CACHE"] = "0"
+
+    results: List[dict] = []
+    meta = _meta(args, preset)
+    repeat, e2e_repeat = preset["repeat"], preset["e2e_repeat"]
+    cwd = os.getcwd()
+    os.chdir(tmp.name)  # main.run writes report.json here
+    try:
+        if "extract_questions" in benches:
+            results += bench_extract_questions(preset["questions"], repeat)
+        if "scrape_website" in benches:
+            results += bench_scrape(repeat)
+
+        client = None
+        if "api" in benches:
+            from fastapi.testclient import TestClient
+            from app.api import app
+
+            client = TestClient(app).__enter__()
+        for rows, columns in datasets(preset["rows"], preset["columns"]):
+            path = make_sales_csv(rows, columns)
+            base_questions = make_sales_questions(min(preset["questions"]))
+            results += bench_csv(path, rows, columns,
+                                 [q.split(". ", 1)[1] for q in base_questions.splitlines()], repeat, benches)
+            for n in preset["questions"]:
+                text = make_sales_questions(n)
+                qfile = Path(tmp.name) / f"questions_{n}.txt"
+                qfile.write_text(text, encoding="utf-8")
+                if "main.run" in benches:
+                    results.append(bench_main_run(path, rows, columns, qfile, n, e2e_repeat))
+                if client is not None:
+                    results.append(bench_api(client, path, rows, columns, text, n, e2e_repeat))
+                print(f"done: {rows} rows x {columns} cols, {n} questions", flush=True)
+        if client is not None:
+            client.__exit__(None, None, None)
+    finally:
+        os.chdir(cwd)
+        meta["llm_server"] = server.stats()
+        server.shutdown()
+        tmp.cleanup()
+    return {"meta": meta, "results": results}
+
+
+def _key(row: dict) -> tuple:
+    return tuple((k, row.get(k)) for k in ("bench", "rows", "columns", "format", "projected", "questions", "plans",
+                                           "page"))
+
+
+def compare(before_path: str, after_path: str) -> List[dict]:
+    """p50/p99/peak RSS of each bench present in both result files, after/before."""
+    with open(before_path, encoding="utf-8") as f:
+        before = {_key(r): r for r in json.load(f)["results"]}
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)["results"]
+    rows = []
+    for new in after:
+        old = before.get(_key(new))
+        if old is None:
+            continue
+        rows.append({
+            **{k: v for k, v in _key(new) if v is not None},
+            "p50_ratio": round(new["p50_s"] / old["p50_s"], 3) if old["p50_s"] else None,
+            "p99_ratio": round(new["p99_s"] / old["p99_s"], 3) if old["p99_s"] else None,
+            "peak_rss_mb": [old["peak_rss_mb"], new["peak_rss_mb"]],
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--rows", type=int, nargs="+", help="override the preset's row counts")
+    parser.add_argument("--columns", type=int, nargs="+", help="override the preset's column counts")
+    parser.add_argument("--questions", type=int, nargs="+", help="override the preset's question counts")
+    parser.add_argument("--repeat", type=int, help="runs per bench (default from the preset)")
+    parser.add_argument("--only", nargs="+", choices=BENCHES, help="run only these benches")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM seconds per response")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake LLM calls answered 429")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="fake LLM requests/min quota (0 = none)")
+    parser.add_argument("--warm-caches", action="store_true", help="keep the LLM and dataset caches on")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files and exit")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+    else:
+        report = run(args)
+        print(json.dumps(report["results"], indent=2))
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
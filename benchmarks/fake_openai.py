@@ -0,0 +1,193 @@
+# benchmarks/fake_openai.py
+"""
+Local stand-in for the OpenAI API, for benchmarks and rate-limit testing.
+Serves /v1/chat/completions and /v1/responses with configurable latency,
+enforces its own requests/min and tokens/min quota (answering 429 with a
+retry-after header like the real service) and can inject random 429s.
+
+    python -m benchmarks.fake_openai --port 8765 --latency 0.2 --rpm 600 --error-rate 0.05
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 and any
+OPENAI_API_KEY. GET /stats returns request counters.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+_NUMBERED = re.compile(r"^\d+\. ", re.MULTILINE)
+
+
+class Quota:
+    """Server-side token bucket, refilled continuously, one second of burst."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate, 1.0)
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+
+    def take(self, amount: float) -> Optional[float]:
+        """None if granted, else seconds until it would be."""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.level >= min(amount, self.capacity):
+            self.level -= amount
+            return None
+        return (min(amount, self.capacity) - self.level) / self.rate
+
+
+def _reply_text(prompt: str) -> str:
+    """Answers shaped like what each pipeline prompt expects."""
+    n = max(len(_NUMBERED.findall(prompt)), 1)
+    if "For each question decide" in prompt:
+        return json.dumps([{"route": "csv", "plan": {"kind": "count_rows"}}] * n)
+    if "Reply with exactly one word" in prompt:
+        return "csv"
+    if "as a JSON object" in prompt:
+        return json.dumps({"kind": "count_rows"})
+    if "JSON list" in prompt or "JSON array" in prompt:
+        return json.dumps([f"answer {i + 1}" for i in range(n)])
+    return "answer"
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.1, jitter: float = 0.0,
+                 rpm: float = 0, tpm: float = 0, error_rate: float = 0.0, retry_after: float = 1.0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency, self.jitter = latency, jitter
+        self.error_rate, self.retry_after = error_rate, retry_after
+        self.rpm = Quota(rpm) if rpm else None
+        self.tpm = Quota(tpm) if tpm else None
+        self.lock = threading.Lock()
+        self.counts: Dict[str, Any] = {"requests": 0, "ok": 0, "quota_429": 0, "injected_429": 0, "tokens": 0}
+        self.started = time.monotonic()
+
+    def handle_error(self, request, client_address):
+        pass  # clients hanging up mid-response are expected under load
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def admit(self, tokens: int) -> Tuple[bool, float, str]:
+        """(ok, retry_after, reason) for one incoming request."""
+        with self.lock:
+            self.counts["requests"] += 1
+            if self.error_rate and random.random() < self.error_rate:
+                self.counts["injected_429"] += 1
+                return False, self.retry_after, "injected"
+            waits = [q.take(a) for q, a in ((self.rpm, 1), (self.tpm, tokens)) if q is not None]
+            waits = [w for w in waits if w is not None]
+            if waits:
+                self.counts["quota_429"] += 1
+                return False, max(waits), "quota"
+            self.counts["ok"] += 1
+            self.counts["tokens"] += tokens
+            return True, 0.0, ""
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {**self.counts, "elapsed_s": round(elapsed, 3),
+                    "ok_per_minute": round(self.counts["ok"] / elapsed * 60, 1) if elapsed else 0.0}
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.counts = {k: 0 for k in self.counts}
+            self.started = time.monotonic()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeOpenAI
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send(200, self.server.stats())
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.endswith("/responses"):
+            prompt = body.get("input") if isinstance(body.get("input"), str) else json.dumps(body.get("input"))
+        else:
+            prompt = body.get("messages", [{}])[-1].get("content", "")
+        prompt_tokens = len(json.dumps(body)) // 4
+        completion_tokens = 20
+
+        ok, retry_after, reason = self.server.admit(prompt_tokens + completion_tokens)
+        if not ok:
+            self._send(429, {"error": {"message": f"Rate limit reached ({reason})", "type": "requests",
+                                       "code": "rate_limit_exceeded"}},
+                       {"retry-after": f"{retry_after:.3f}", "retry-after-ms": str(int(retry_after * 1000))})
+            return
+
+        time.sleep(max(self.server.latency + random.uniform(-self.server.jitter, self.server.jitter), 0))
+        text = _reply_text(prompt)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if self.path.endswith("/responses"):
+            self._send(200, {
+                "id": "resp_fake", "object": "response", "created_at": int(time.time()),
+                "model": body.get("model"), "status": "completed", "parallel_tool_calls": False,
+                "tool_choice": "auto", "tools": [],
+                "output": [{"type": "message", "id": "msg_fake", "role": "assistant", "status": "completed",
+                            "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+                "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                          "total_tokens": usage["total_tokens"],
+                          "input_tokens_details": {"cached_tokens": 0},
+                          "output_tokens_details": {"reasoning_tokens": 0}},
+            })
+        else:
+            self._send(200, {
+                "id": "chatcmpl_fake", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": usage,
+            })
+
+
+def start_server(**options) -> FakeOpenAI:
+    """Start a FakeOpenAI in a daemon thread (port 0 picks a free port)."""
+    server = FakeOpenAI(**options)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of latency noise")
+    parser.add_argument("--rpm", type=float, default=0, help="requests/min quota (0 = none)")
+    parser.add_argument("--tpm", type=float, default=0, help="tokens/min quota (0 = none)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 429 at random")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds on injected 429s")
+    args = parser.parse_args()
+    server = FakeOpenAI(args.port, args.latency, args.jitter, args.rpm, args.tpm, args.error_rate, args.retry_after)
+    print(f"Fake OpenAI API on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,196 @@
+# benchmarks/synthetic.py
+"""Deterministic synthetic inputs for the benchmarks."""
+import gzip
+import random
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+HTML_DIR = Path(__file__).parent / "html"
+DATA_DIR = Path(__file__).parent / "data"
+
+_WORDS = (
+    "the film grossed worldwide box office release studio director sequel "
+    "record opening weekend highest domestic international budget franchise"
+).split()
+
+
+def _sentence(rng: random.Random, n: int = 18) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(n)).capitalize() + "."
+
+
+def make_wiki_page(rows: int = 2000, tables: int = 4, paragraphs: int = 200, seed: int = 0) -> str:
+    """A Wikipedia-style list article: lots of prose plus large wikitables."""
+    rng = random.Random(seed)
+    parts = ['<html><head><title>List of films</title></head><body>',
+             '<div id="mw-navigation"><ul>' + "<li>nav</li>" * 200 + "</ul></div>",
+             '<div id="mw-content-text"><div class="mw-parser-output">']
+    per_section = max(paragraphs // max(tables, 1), 1)
+    for t in range(tables):
+        parts.append(f"<h2>Section {t + 1}</h2>")
+        for _ in range(per_section):
+            parts.append(f"<p>{_sentence(rng)} <a href='#'>{rng.choice(_WORDS)}</a> {_sentence(rng)}<sup>[{t}]</sup></p>")
+        parts.append('<table class="wikitable sortable"><tbody>'
+                     "<tr><th>Rank</th><th>Peak</th><th>Title</th><th>Worldwide gross</th><th>Year</th><th>Ref</th></tr>")
+        for r in range(rows):
+            parts.append(
+                f"<tr><td>{r + 1}</td><td>{rng.randint(1, 50)}</td>"
+                f"<td><i><a href='/wiki/Film_{r}'>Film {r}</a></i></td>"
+                f"<td>${rng.randint(100_000_000, 3_000_000_000):,}</td>"
+                f"<td>{rng.randint(1950, 2024)}</td><td><sup>[{r}]</sup></td></tr>"
+            )
+        parts.append("</tbody></table>")
+    parts.append("</div></div></body></html>")
+    return "".join(parts)
+
+
+_QUESTION_STARTS = (
+    "What is the", "Which film had the", "How many films had a", "Who directed the",
+    "When was the", "Is the", "Can you list the",
+)
+
+
+def make_question_log(size_mb: float = 10, dup_ratio: float = 0.3, seed: int = 0) -> str:
+    """
+    An exported question log: "Q<n>:" / numbered / bare questions mixed
+    with prose lines that contain none, with `dup_ratio` repeated questions.
+    """
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    asked: list = []
+    parts, size, n = [], 0, 0
+    while size < target:
+        r = rng.random()
+        if asked and r < dup_ratio * 0.5:
+            line = rng.choice(asked)
+        elif r < 0.5:
+            n += 1
+            q = f"{rng.choice(_QUESTION_STARTS)} {' '.join(rng.choice(_WORDS) for _ in range(rng.randint(2, 10)))} in {rng.randint(1950, 2024)}?"
+            line = rng.choice((f"Q{n}: {q}", f"{n}. {q}", q))
+            asked.append(q)
+        else:
+            line = _sentence(rng, rng.randint(5, 30))
+        parts.append(line)
+        size += len(line) + 1
+    return "\n".join(parts)
+
+
+def html_fixtures() -> list:
+    """Saved pages in benchmarks/html/; writes a synthetic one if there are none."""
+    HTML_DIR.mkdir(exist_ok=True)
+    pages = sorted(HTML_DIR.glob("*.html"))
+    if not pages:
+        path = HTML_DIR / "synthetic_film_list.html"
+        path.write_text(make_wiki_page(), encoding="utf-8")
+        pages = [path]
+    return pages
+
+
+_REGIONS = np.array(["North", "South", "East", "West", "Central"])
+_PRODUCTS = np.array([f"Product {i:02d}" for i in range(50)])
+_ATTRS = np.array([f"level_{i}" for i in range(20)])
+SALES_BASE_COLUMNS = ("order_id", "date", "region", "product", "customer", "sales", "quantity", "discount")
+
+
+def _sales_chunk(rng: np.random.Generator, start: int, rows: int, columns: int) -> pd.DataFrame:
+    ids = np.arange(start, start + rows)
+    data = {
+        "order_id": ids,
+        "date": (np.datetime64("2020-01-01") + rng.integers(0, 4 * 365, rows)).astype(str),
+        "region": _REGIONS[rng.integers(0, len(_REGIONS), rows)],
+        "product": _PRODUCTS[rng.integers(0, len(_PRODUCTS), rows)],
+        "customer": np.char.add("C", rng.integers(0, max(rows * 4, 1000), rows).astype(str)),
+        "sales": np.round(rng.lognormal(4, 1, rows), 2),
+        "quantity": rng.integers(1, 20, rows),
+        "discount": np.round(rng.uniform(0, 0.3, rows), 3),
+    }
+    for i in range(columns - len(SALES_BASE_COLUMNS)):
+        if i % 2:
+            data[f"attr_{i}"] = _ATTRS[rng.integers(0, len(_ATTRS), rows)]
+        else:
+            data[f"metric_{i}"] = np.round(rng.normal(100, 25, rows), 2)
+    return pd.DataFrame(data)
+
+
+def make_sales_csv(rows: int, columns: int = len(SALES_BASE_COLUMNS), seed: int = 0,
+                   chunk_rows: int = 250_000) -> Path:
+    """
+    benchmarks/data/sales_<rows>x<columns>.csv: orders with a date, region,
+    product, customer id and numeric sales columns, padded to `columns`
+    with alternating numeric and low-cardinality text columns. Written in
+    chunks (10M-row files never sit in memory) and reused if present.
+    """
+    columns = max(columns, len(SALES_BASE_COLUMNS))
+    path = DATA_DIR / f"sales_{rows}x{columns}.csv"
+    if path.exists():
+        return path
+    DATA_DIR.mkdir(exist_ok=True)
+    rng = np.random.default_rng(seed)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        for start in range(0, rows, chunk_rows):
+            chunk = _sales_chunk(rng, start, min(chunk_rows, rows - start), columns)
+            chunk.to_csv(f, index=False, header=start == 0)
+    tmp.replace(path)
+    return path
+
+
+SALES_FORMATS = ("csv", "csv.gz", "parquet", "feather")
+
+
+def sales_as(path: Path, fmt: str) -> Path:
+    """
+    A make_sales_csv file converted to `fmt` (one of SALES_FORMATS) next
+    to it, streamed batch by batch and reused if present. Parquet and
+    Feather need pyarrow.
+    """
+    if fmt == "csv":
+        return path
+    out = path.with_suffix(f".{fmt}")
+    if out.exists():
+        return out
+    tmp = out.with_suffix(".tmp")
+    if fmt == "csv.gz":
+        with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+    else:
+        import pyarrow.csv as pacsv
+        import pyarrow.ipc as ipc
+        import pyarrow.parquet as pq
+
+        reader = pacsv.open_csv(path)
+        writer = (pq.ParquetWriter(tmp, reader.schema) if fmt == "parquet"
+                  else ipc.new_file(str(tmp), reader.schema))
+        with writer:
+            for batch in reader:
+                writer.write_batch(batch)
+    tmp.replace(out)
+    return out
+
+
+_SALES_QUESTIONS = (
+    "How many rows are there in the dataset?",
+    "What is the total sales?",
+    "What is the median sales?",
+    "Which region has the highest total sales?",
+    "What is the correlation between sales and discount?",
+    "What is the total quantity?",
+    "Which product has the highest total sales?",
+    "What is the median discount?",
+    "Can you plot a bar chart of sales by region?",
+    "Can you draw a line chart of sales over date?",
+)
+
+
+def make_sales_questions(count: int = 10, seed: int = 0) -> str:
+    """A numbered question file of `count` questions about make_sales_csv data."""
+    rng = random.Random(seed)
+    picks = list(_SALES_QUESTIONS) * (count // len(_SALES_QUESTIONS) + 1)
+    head, tail = picks[:len(_SALES_QUESTIONS)], picks[len(_SALES_QUESTIONS):]
+    rng.shuffle(tail)
+    # Repeats differ in wording so they are not deduplicated away
+    lines = [q if i < len(_SALES_QUESTIONS) else q.replace("?", f" (variant {i})?")
+             for i, q in enumerate((head + tail)[:count])]
+    return "\n".join(f"{i + 1}. {q}" for i, q in enumerate(lines)) + "\n"
@@ -0,0 +1,155 @@
+# tests/test_ratelimit.py
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from app import ratelimit
+from app.llm import LLMClient, aclose_llm_clients
+from app.ratelimit import (PRIORITY_BATCH, PRIORITY_INTERACTIVE, RateLimiter, TokenBucket,
+                           backoff_delay, classify_error, request_priority)
+from benchmarks.fake_openai import start_server
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Start a fake OpenAI server and point the app at it; yields a starter."""
+    servers = []
+
+    def start(**options):
+        server = start_server(latency=0.01, **options)
+        servers.append(server)
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "fake")
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def use_limiter(monkeypatch, limiter: RateLimiter) -> RateLimiter:
+    monkeypatch.setattr(ratelimit, "_limiter", limiter)
+    return limiter
+
+
+def call_llm(n: int, priority: int = PRIORITY_INTERACTIVE) -> list:
+    """`n` concurrent chat calls through LLMClient; exceptions are returned, not raised."""
+    llm = LLMClient(use_cache=False, max_concurrency=64)
+
+    async def run():
+        try:
+            with request_priority(priority):
+                return await asyncio.gather(*(llm._achat(llm._messages(f"Say hello #{i}")) for i in range(n)),
+                                            return_exceptions=True)
+        finally:
+            await aclose_llm_clients()
+
+    return asyncio.run(run())
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(per_minute=60, burst_seconds=1)
+    t = bucket._stamp
+    assert bucket.delay(1, t) == 0
+    bucket.take(1, t)
+    assert bucket.delay(1, t) == pytest.approx(1.0)
+    assert bucket.delay(1, t + 0.25) == pytest.approx(0.75)
+    # Overdrawn (real usage above the estimate): the debt is paid back first
+    bucket.take(2, t + 1)
+    assert bucket.delay(1, t + 1) == pytest.approx(2.0)
+
+
+def test_limiter_admits_at_the_configured_rate():
+    limiter = RateLimiter(rpm=1200, tpm=0)  # 20/s, one second of burst
+
+    async def run():
+        await asyncio.gather(*(limiter.acquire() for _ in range(40)))
+
+    t0 = time.monotonic()
+    asyncio.run(run())
+    elapsed = time.monotonic() - t0
+    assert limiter.admitted == 40
+    assert 0.9 <= elapsed < 2.0  # 20 from the burst, 20 more at 20/s
+
+
+def test_limiter_keeps_under_the_server_quota(fake_openai, monkeypatch):
+    server = fake_openai(rpm=1200)
+    use_limiter(monkeypatch, RateLimiter(rpm=960, tpm=0))
+    t0 = time.monotonic()
+    replies = call_llm(40)
+    elapsed = time.monotonic() - t0
+    assert all(isinstance(r, str) for r in replies)
+    stats = server.stats()
+    assert stats["quota_429"] == 0
+    assert stats["ok"] == 40
+    assert elapsed >= 1.3  # 16 from the burst, 24 more at 16/s
+
+
+def test_queued_calls_run_in_priority_order():
+    limiter = RateLimiter(rpm=0, tpm=0)
+    limiter.pause(0.1)
+    order = []
+
+    async def call(tag: str, priority: int):
+        await limiter.acquire(priority=priority)
+        order.append(tag)
+
+    async def run():
+        batch = [asyncio.ensure_future(call(f"batch{i}", PRIORITY_BATCH)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        interactive = [asyncio.ensure_future(call(f"api{i}", PRIORITY_INTERACTIVE)) for i in range(2)]
+        await asyncio.gather(*batch, *interactive)
+
+    asyncio.run(run())
+    assert order == ["api0", "api1", "batch0", "batch1", "batch2"]
+    assert limiter.stats()["queued"] == 0
+
+
+def test_backoff_delay_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(ratelimit.random, "uniform", lambda low, high: high)
+    assert [backoff_delay(a, base=0.5, cap=10) for a in range(7)] == [0.5, 1, 2, 4, 8, 10, 10]
+    monkeypatch.undo()
+    assert all(0 <= backoff_delay(a, base=0.5, cap=10) <= min(10, 0.5 * 2 ** a) for a in range(20))
+
+
+def test_classify_error_on_a_429_from_the_server(fake_openai):
+    server = fake_openai(error_rate=1.0, retry_after=0.25)
+    client = openai.OpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+    with pytest.raises(openai.RateLimitError) as caught:
+        client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "hi"}])
+    client.close()
+    assert classify_error(caught.value) == (True, True, 0.25)
+
+
+@pytest.mark.parametrize("status, headers, expected", [
+    (500, {}, (True, False, None)),
+    (503, {"retry-after": "2"}, (True, False, 2.0)),
+    (408, {}, (True, False, None)),
+    (400, {}, (False, False, None)),
+])
+def test_classify_error_by_status(status, headers, expected):
+    request = httpx.Request("POST", "https://api.openai.test/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    error = openai.APIStatusError("boom", response=response, body=None)
+    assert classify_error(error) == expected
+
+
+def test_classify_error_on_a_dropped_connection():
+    request = httpx.Request("POST", "https://api.openai.test/v1/chat/completions")
+    assert classify_error(openai.APIConnectionError(request=request)) == (True, False, None)
+    assert classify_error(ValueError("bad json")) == (False, False, None)
+
+
+def test_429s_are_retried_and_paused(fake_openai, monkeypatch):
+    server = fake_openai(error_rate=0.2, retry_after=0.05)
+    limiter = use_limiter(monkeypatch, RateLimiter(rpm=0, tpm=0))
+    replies = call_llm(20, priority=PRIORITY_BATCH)
+    assert all(isinstance(r, str) for r in replies)
+    stats = server.stats()
+    assert stats["ok"] == 20
+    assert limiter.stats()["retries"] == stats["injected_429"]
+    assert limiter.stats()["pauses"] == stats["injected_429"]
@@ -0,0 +1,100 @@
+# tests/test_web.py
+import asyncio
+
+import httpx
+import pytest
+
+from app import web
+
+URL = "https://en.wikipedia.org/wiki/Films"
+ETAG = '"v1"'
+HTML = """<html><body><div id="mw-content-text">
+<h2>Films</h2><p>Highest-grossing films.</p>
+<table class="wikitable">
+<tr><th>Rank</th><th>Title</th><th>Gross</th></tr>
+<tr><td>1</td><td>Avatar</td><td>2923706026</td></tr>
+<tr><td>2</td><td>Titanic</td><td>2257844554</td></tr>
+</table>
+</div></body></html>"""
+TEXT = "Films\n\nHighest-grossing films.\n\nRank,Title,Gross\n1,Avatar,2923706026\n2,Titanic,2257844554\n"
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    # Every call goes to the server; 304s are served from the HTTP cache
+    monkeypatch.setattr(web, "WEB_CACHE_TTL", 0)
+    web._http_cache.clear()
+    web._text_cache.clear()
+    yield
+    web._http_cache.clear()
+    web._text_cache.clear()
+
+
+class Server:
+    """MockTransport handler: a page with an ETag, recording request headers."""
+
+    def __init__(self, on_conditional=None):
+        self.requests = []
+        self.on_conditional = on_conditional
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == ETAG:
+            if self.on_conditional:
+                self.on_conditional()
+            return httpx.Response(304, headers={"ETag": ETAG})
+        return httpx.Response(200, headers={"ETag": ETAG, "Content-Type": "text/html"}, text=HTML)
+
+
+def scrape(server: Server, times: int):
+    async def run():
+        # Stand-in for this loop's pooled client
+        web._async_clients[asyncio.get_running_loop()] = httpx.AsyncClient(transport=httpx.MockTransport(server))
+        try:
+            return [await web.scrape_website_async(URL) for _ in range(times)]
+        finally:
+            await web.aclose_web_client()
+    return asyncio.run(run())
+
+
+def test_200_is_extracted_and_validators_kept():
+    server = Server()
+    assert scrape(server, 1) == [TEXT]
+    assert "if-none-match" not in server.requests[0]
+    assert web._http_cache[URL][0] == ETAG
+
+
+def test_304_serves_the_cached_page():
+    server = Server()
+    assert scrape(server, 2) == [TEXT, TEXT]
+    assert server.requests[1]["if-none-match"] == ETAG
+    assert len(server.requests) == 2
+
+
+def test_304_after_eviction_refetches_unconditionally():
+    server = Server(on_conditional=web._http_cache.clear)
+    assert scrape(server, 2) == [TEXT, TEXT]
+    assert [r.get("if-none-match") for r in server.requests] == [None, ETAG, None]
+
+
+def test_scrape_many_keeps_order():
+    server = Server()
+
+    async def run():
+        web._async_clients[asyncio.get_running_loop()] = httpx.AsyncClient(transport=httpx.MockTransport(server))
+        try:
+            return await web.scrape_many([URL, URL + "_2"])
+        finally:
+            await web.aclose_web_client()
+
+    assert asyncio.run(run()) == [TEXT, TEXT]
+
+
+@pytest.mark.skipif(web.lxml is None, reason="lxml not installed")
+def test_lxml_and_bs4_extract_the_same_text():
+    assert web._extract_lxml(HTML) == TEXT
+    assert web._extract_bs4(HTML) == TEXT
+
+
+def test_missing_content_section():
+    assert web.extract_content("<html><body><p>hi</p></body></html>") == "No content section found."